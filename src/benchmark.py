@@ -0,0 +1,241 @@
+"""
+Headless benchmark of the Gameplay raycasting renderer.
+
+Flies scripted camera paths through the example maps and the map files in
+src/maps at several resolutions using SDL's dummy video driver, so no window
+or keyboard input is needed, and saves the timings to a JSON file.
+
+Usage:
+    python benchmark.py --frames 300 --resolutions 640x360 1280x720
+                        --output bench.json
+"""
+import os
+
+# The dummy video driver has to be chosen before pygame is initialised.
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import argparse
+import glob
+import json
+import math
+import platform
+import time
+import numpy as np
+import pygame
+
+from maps.chunkedmap import ChunkedMap
+from maps.gridmap import GridMap
+from maps.mapfile import import_map
+from vector import Vector
+
+MAPS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "maps")
+
+
+def load_maps():
+    """Return a dict of every benchmark map keyed by its name."""
+    from maps.example_maps import default_map, new_map
+    maps = {"default_map": GridMap.from_list(default_map),
+            "new_map": GridMap.from_list(new_map)}
+    # The old pickled maps (.txt) as well as binary map files (.rcmap).
+    file_paths = (glob.glob(os.path.join(MAPS_DIR, "*.txt"))
+                  + glob.glob(os.path.join(MAPS_DIR, "*.rcmap")))
+    for file_path in sorted(file_paths):
+        maps[os.path.basename(file_path)] = import_map(file_path)
+    return maps
+
+
+def start_cell(world_map):
+    """
+    Return the centre of the spawn cell (-1) of a map, or if there isn't one
+    the centre of the empty cell closest to the middle of the map.
+    """
+    if isinstance(world_map, ChunkedMap):
+        spawn = world_map.spawn
+        if spawn is None:
+            raise ValueError(f"{world_map.path} has no spawn point.")
+    else:
+        spawn = world_map.find(-1)
+    if spawn is not None:
+        return Vector(spawn[0] + 0.5, spawn[1] + 0.5)
+    xs, ys = np.nonzero(world_map.cells == 0)
+    i = np.argmin((xs - world_map.height/2)**2 + (ys - world_map.width/2)**2)
+    return Vector(xs[i] + 0.5, ys[i] + 0.5)
+
+
+def rotate(vector, angle):
+    """Return a vector rotated by angle radians."""
+    return Vector(vector.x*math.cos(angle) - vector.y*math.sin(angle),
+                  vector.x*math.sin(angle) + vector.y*math.cos(angle))
+
+
+def spin_path(world_map, frames):
+    """Stand still at the start cell and turn a full circle."""
+    pos = start_cell(world_map)
+    for i in range(frames):
+        angle = 2*math.pi * i / frames
+        yield pos, rotate(Vector(-1, 0), angle), rotate(Vector(0, 0.66), angle)
+
+
+def walk_path(world_map, frames, speed=0.05):
+    """
+    Walk forward from the start cell, turning 90 degrees to the left whenever
+    a wall is in the way.
+    """
+    pos = start_cell(world_map)
+    dir = Vector(-1, 0)
+    plane = Vector(0, 0.66)
+    for i in range(frames):
+        yield pos, dir, plane
+        newPos = pos + dir*speed
+        if world_map.get(int(newPos.x), int(newPos.y)) > 0:
+            dir = rotate(dir, math.pi / 2)
+            plane = rotate(plane, math.pi / 2)
+        else:
+            pos = newPos
+
+
+PATHS = {"spin": spin_path, "walk": walk_path}
+
+
+def run(gameplay, surface, world_map, path, frames):
+    """Draw every frame of a camera path and return the timing results."""
+    if isinstance(world_map, GridMap) and not world_map.has_border():
+        world_map = world_map.add_border()
+    gameplay.worldMap = world_map
+
+    frame_times = []
+    steps = 0
+    for pos, dir, plane in PATHS[path](world_map, frames):
+        gameplay.pos = Vector(pos.x, pos.y)
+        gameplay.dir = Vector(dir.x, dir.y)
+        gameplay.plane = Vector(plane.x, plane.y)
+
+        start = time.perf_counter()
+        gameplay.draw(surface)
+        frame_times.append(time.perf_counter() - start)
+        steps += int(np.sum(gameplay.hits.steps))
+
+    frame_times = np.array(frame_times)
+    rays = surface.get_width() * frames
+    return {
+        "frames": frames,
+        "frame_ms": {
+            "mean": float(frame_times.mean() * 1000),
+            "p50": float(np.percentile(frame_times, 50) * 1000),
+            "p95": float(np.percentile(frame_times, 95) * 1000),
+            "p99": float(np.percentile(frame_times, 99) * 1000),
+        },
+        "rays_per_second": float(rays / frame_times.sum()),
+        "dda_steps_per_ray": steps / rays,
+        "texture_cache": (gameplay.wall_textures.cache.stats()
+                          if gameplay.textured_walls else None),
+        "tile_cache": (world_map.stats()
+                       if isinstance(world_map, ChunkedMap) else None),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--frames", type=int, default=120,
+                        help="frames drawn per camera path")
+    parser.add_argument("--resolutions", nargs="+",
+                        default=["640x360", "1280x720", "1920x1080"],
+                        help="WIDTHxHEIGHT resolutions to draw at")
+    parser.add_argument("--maps", nargs="+",
+                        help="names of the maps to run (default: all)")
+    parser.add_argument("--paths", nargs="+", choices=sorted(PATHS),
+                        default=sorted(PATHS), help="camera paths to fly")
+    parser.add_argument("--scalar", action="store_true",
+                        help="cast rays with the scalar loop")
+    parser.add_argument("--skip", action="store_true",
+                        help="skip across empty space with a distance field")
+    parser.add_argument("--flat", action="store_true",
+                        help="draw flat coloured walls instead of textures")
+    parser.add_argument("--floors", action="store_true",
+                        help="cast a textured floor and ceiling")
+    parser.add_argument("--world", nargs="+", default=[],
+                        help="chunk files to run as well, streamed through "
+                             "a tile cache of --tiles tiles")
+    parser.add_argument("--tiles", type=int, default=1024,
+                        help="tiles cached of each --world chunk file")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="parallel render workers")
+    parser.add_argument("--label", default="",
+                        help="label stored with the results, e.g. a version")
+    parser.add_argument("--output", default="benchmark.json",
+                        help="JSON file the results are saved to")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode((1, 1))
+    from gamestates.gameplay import Gameplay
+
+    maps = load_maps()
+    names = args.maps or list(maps)
+    worlds = {os.path.basename(path): path for path in args.world}
+    names += list(worlds)
+
+    results = {
+        "label": args.label,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "engine": "scalar" if args.scalar else "vectorized",
+        "workers": args.workers,
+        "empty_space_skipping": args.skip,
+        "textured_walls": not args.flat,
+        "floor_casting": args.floors,
+        "runs": [],
+    }
+
+    for resolution in args.resolutions:
+        w, h = (int(n) for n in resolution.lower().split("x"))
+        surface = pygame.Surface((w, h))
+        for name in names:
+            for path in args.paths:
+                if name in worlds:
+                    # Every run streams its world from a cold cache. Tiles
+                    # are read as soon as rays reach them, and the time taken
+                    # is part of the frame, so every run draws the same
+                    # frames.
+                    world_map = ChunkedMap(worlds[name], args.tiles,
+                                           threads=False)
+                else:
+                    world_map = maps[name]
+                gameplay = Gameplay()
+                gameplay.persist = {"map": world_map, "multi_flag": 0}
+                gameplay.vectorized = not args.scalar
+                gameplay.render_workers = args.workers
+                gameplay.empty_space_skipping = args.skip
+                gameplay.textured_walls = not args.flat
+                gameplay.floor_casting = args.floors
+
+                result = run(gameplay, surface, world_map, path, args.frames)
+                result.update({"map": name, "path": path,
+                               "resolution": [w, h]})
+                results["runs"].append(result)
+
+                print(f"{resolution:>9} {name:<22} {path:<5} "
+                      f"p50 {result['frame_ms']['p50']:7.2f} ms  "
+                      f"p95 {result['frame_ms']['p95']:7.2f} ms  "
+                      f"p99 {result['frame_ms']['p99']:7.2f} ms  "
+                      f"{result['rays_per_second']:11.0f} rays/s  "
+                      f"{result['dda_steps_per_ray']:5.2f} steps/ray")
+                if result["texture_cache"] is not None:
+                    print(f"{'':>9} texture cache hit rate "
+                          f"{result['texture_cache']['hit rate']:.1%}")
+                if result["tile_cache"] is not None:
+                    print(f"{'':>9} tile cache hit rate "
+                          f"{result['tile_cache']['hit rate']:.1%}, "
+                          f"{result['tile_cache']['loads']} tiles loaded")
+                    world_map.close()
+
+    with open(args.output, "w") as fp:
+        json.dump(results, fp, indent=2)
+    print("Results saved to", args.output)
+
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
+import collections
+import queue
 import socket
-import pickle
+import threading
+import time
+import protocol
+
+# Seconds between the pings used to measure latency.
+PING_INTERVAL = 1.0
 
 
 class Client:
@@ -10,48 +17,192 @@ class Client:
         self.port = 5555
         # Create an IPv4 (AF_INET), TCP (SOCK_STREAM) socket.
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Send small position updates straight away instead of batching them.
+        self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         self.socket.connect((self.host, self.port))
         # Take the client id to be its local port.
         self.id = self.socket.getsockname()[1]
 
-    def send(self, data):
-        """Send data from the client to the server."""
-        # Serialize the data so it can be sent as a byte stream to the socket.
-        message = pickle.dumps(data)
-        msg_len = len(message)
+        # Payloads waiting to be sent and messages waiting to be read. The
+        # socket is only used by the background threads so the game never
+        # waits on the network.
+        self.outbound = collections.deque()
+        self.inbound = queue.Queue()
+        # Signalled when a payload is queued to send or the client closes.
+        self.outbound_ready = threading.Condition()
+        # The position payload waiting in outbound, if there is one. Only the
+        # latest position is worth sending, so a new one replaces it and
+        # outbound never fills up with positions if the network falls behind.
+        self.queued_position = None
+
+        # Connection health.
+        self.connected = True
+        self.latency = None
+        self.packets_received = 0
+        self.last_receive_time = None
+        # Messages from other players, which unlike pings and pongs show the
+        # other players are still there.
+        self.peer_messages_received = 0
+        self.last_peer_time = None
+
+        self.sender = threading.Thread(target=self.send_loop, daemon=True)
+        self.receiver = threading.Thread(target=self.receive_loop, daemon=True)
+        self.sender.start()
+        self.receiver.start()
+
+    def send(self, payload):
+        """
+        Queue a protocol message payload to be sent to the server. A position
+        replaces any position that hasn't been sent yet, and goes after
+        everything else queued so it's never sent before a map change it
+        comes after.
+        """
+        with self.outbound_ready:
+            # The message type is the first byte of the payload.
+            if payload[0] == protocol.POSITION:
+                if self.queued_position is not None:
+                    self.outbound.remove(self.queued_position)
+                self.queued_position = payload
+            self.outbound.append(payload)
+            self.outbound_ready.notify()
+
+    def receive(self, timeout=None):
+        """
+        Return the next message received from the server decoded into a dict,
+        waiting up to timeout seconds (forever if None). Returns None if no
+        message arrives in time.
+        """
         try:
-            # Send what the total length of the message to be sent is in bytes.
-            self.socket.send(msg_len.to_bytes(4, 'big'))
-            self.socket.sendall(message)
-        except socket.error as e:
-            return str(e)
-
-    def receive(self):
-        """Return data received from the server."""
-        # Find how big message to be received is in bytes.
-        remaining = int.from_bytes(self.socket.recv(4), 'big')
-        chunks = []
-        # While there are still bytes to receive.
-        while remaining:
-            # Get remaining bytes or 4096 bytes (whatever is smaller).
-            chunk = self.socket.recv(min(remaining, 4096))
-            remaining -= len(chunk)
-            chunks.append(chunk)
-
-        chunks = b"".join(chunks)
-        # Deserialize the received byte stream to return data to its original
-        # data type.
-        data = pickle.loads(chunks)
-        return data
+            return self.inbound.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def receive_all(self):
+        """Return every message received since last called without waiting."""
+        messages = []
+        while True:
+            try:
+                messages.append(self.inbound.get_nowait())
+            except queue.Empty:
+                return messages
+
+    def health(self):
+        """
+        Return a dict of the connection's health: whether it's still
+        connected, the round trip latency in seconds, the number of packets
+        received and the seconds since the last one, and the same for
+        messages from other players.
+        """
+        now = time.monotonic()
+        since_last = None
+        if self.last_receive_time is not None:
+            since_last = now - self.last_receive_time
+        since_last_peer = None
+        if self.last_peer_time is not None:
+            since_last_peer = now - self.last_peer_time
+        return {"connected": self.connected, "latency": self.latency,
+                "packets received": self.packets_received,
+                "since last packet": since_last,
+                "peer messages received": self.peer_messages_received,
+                "since last update": since_last_peer}
+
+    def send_loop(self):
+        """Background thread sending queued payloads and regular pings."""
+        next_ping = time.monotonic()
+        while self.connected:
+            payload = None
+            with self.outbound_ready:
+                self.outbound_ready.wait_for(
+                    lambda: self.outbound or not self.connected,
+                    timeout=max(next_ping - time.monotonic(), 0))
+                if self.outbound and self.connected:
+                    payload = self.outbound.popleft()
+                    if payload is self.queued_position:
+                        self.queued_position = None
+            if not self.connected:
+                break
+
+            if time.monotonic() >= next_ping:
+                next_ping = time.monotonic() + PING_INTERVAL
+                self.write(protocol.encode_ping(self.id, time.monotonic()))
+            if payload is not None:
+                self.write(payload)
+
+    def write(self, payload):
+        """Send a payload to the server as a frame."""
+        try:
+            # The payload is sent after the total length of it in bytes.
+            self.socket.sendall(protocol.frame(payload))
+        except socket.error:
+            self.connected = False
+
+    def receive_loop(self):
+        """Background thread reading and decoding messages from the server."""
+        while self.connected:
+            try:
+                payload = protocol.read_frame(self.socket)
+            except socket.error:
+                payload = None
+            if payload is None:
+                self.connected = False
+                break
+
+            try:
+                message = protocol.decode(payload)
+            except protocol.ProtocolError as e:
+                print(f"Bad message: {e}")
+                continue
+            self.packets_received += 1
+            self.last_receive_time = time.monotonic()
+
+            # The server answers this client's pings, so the latency is the
+            # round trip to the server.
+            if message["type"] == protocol.PONG:
+                if message["to"] == self.id:
+                    self.latency = time.monotonic() - message["time"]
+            elif message["type"] != protocol.PING:
+                self.peer_messages_received += 1
+                self.last_peer_time = time.monotonic()
+                self.inbound.put(message)
+
+    def close(self):
+        """
+        Close the connection and wait for the background threads to stop,
+        dropping any messages still queued either way.
+        """
+        # Wake the sender up if it's waiting for something to send.
+        with self.outbound_ready:
+            self.connected = False
+            self.outbound_ready.notify()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.socket.close()
+        for thread in (self.sender, self.receiver):
+            if thread is not threading.current_thread():
+                thread.join()
+        with self.outbound_ready:
+            self.outbound.clear()
+            self.queued_position = None
+        while True:
+            try:
+                self.inbound.get_nowait()
+            except queue.Empty:
+                break
 
 
 if __name__ == '__main__':
     # Testing.
+    from vector import Vector
+    from maps.gridmap import GridMap
+
     client1 = Client()
     client2 = Client()
+    map = GridMap(4, 4)
 
     while True:
-        client1.send(map)
-        client2.send((3, 2))
-        print(f"Client 1 received: {client1.receive()}")
-        print(f"Client 2 received: {client2.receive()}")
+        client1.send(protocol.encode_position(client1.id, Vector(1.5, 2.5), map))
+        client2.send(protocol.encode_position(client2.id, Vector(3, 2), map))
+        print(f"Client 1 received: {client1.receive()} {client1.health()}")
+        print(f"Client 2 received: {client2.receive()} {client2.health()}")
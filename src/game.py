@@ -1,3 +1,4 @@
+import argparse
 import sys
 import pygame
 import tkinter as tk
@@ -6,6 +7,7 @@ from gamestates.menuscreen import MenuScreen
 from gamestates.loadmap import LoadMap
 from gamestates.mapeditor import MapEditor
 from gamestates.gameplay import Gameplay
+from profiler import FrameProfiler
 
 # Initialize and hide tkinter root window
 root = tk.Tk()
@@ -13,25 +15,41 @@ root.withdraw()
 
 
 class Game:
-    def __init__(self, states, start_state):
+    def __init__(self, states, start_state, profiler=None):
         self.done = False
         self.screen = pygame.display.set_mode((0, 0))
         self.clock = pygame.time.Clock()
         self.fps = 60
+        # Times each phase of every frame when enabled. profile_dump is the
+        # CSV or JSON file the frame times are saved to on exit, if any.
+        self.profiler = FrameProfiler() if profiler is None else profiler
+        self.profile_dump = None
         self.states = states
+        # Let every state know the frame rate, e.g. so Gameplay knows how long
+        # it has to draw a frame, and give them the profiler.
+        for state in self.states.values():
+            state.fps = self.fps
+            state.profiler = self.profiler
         self.state_name = start_state
         self.state = self.states[self.state_name]
 
     def event_loop(self):
         """Gets pygame events and passes them to a gamestate."""
         for event in pygame.event.get():
+            # F3 shows or hides the profiler overlay, turning profiling on.
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.profiler.overlay = not self.profiler.overlay
+                if self.profiler.overlay:
+                    self.profiler.enabled = True
             self.state.get_event(event)
 
     def change_state(self):
         """Change from one game state to another."""
         # Pass the persistent variables of the previous state to the next state.
         persistent = self.state.persist
-        self.state = self.states[self.state.next_state]
+        self.state.cleanup()
+        self.state_name = self.state.next_state
+        self.state = self.states[self.state_name]
         self.state.startup(persistent)
 
     def update(self, dt):
@@ -44,31 +62,58 @@ class Game:
             self.done = True
         elif self.state.done:
             self.change_state()
-        self.state.update(dt)
+        with self.profiler.phase(f"update {self.state_name}"):
+            self.state.update(dt)
 
     def draw(self):
         """Draw a gamestate to the screen."""
-        self.state.draw(self.screen)
+        with self.profiler.phase(f"draw {self.state_name}"):
+            self.state.draw(self.screen)
+        self.profiler.draw_overlay(self.screen)
 
     def run(self):
         """
         Infinite while loop that runs all the functions of the game until the
         user exits.
         """
+        profiler = self.profiler
         while not self.done:
-            # dt - change in time between each frame is found.
-            dt = self.clock.tick(self.fps)
-            self.event_loop()
+            profiler.begin_frame()
+            # dt - change in time between each frame is found. The tick phase
+            # is mostly time spent waiting to keep to the frame rate.
+            with profiler.phase("tick"):
+                dt = self.clock.tick(self.fps)
+            with profiler.phase("events"):
+                self.event_loop()
             self.update(dt)
             self.draw()
-            pygame.display.update()
+            with profiler.phase("display"):
+                pygame.display.update()
+            profiler.end_frame()
+
+        self.state.cleanup()
+        if self.profile_dump is not None:
+            profiler.dump(self.profile_dump)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", action="store_true",
+                        help="time each phase of every frame (F3 in game)")
+    parser.add_argument("--profile-log", type=float, metavar="SECONDS",
+                        help="print frame time percentiles this often")
+    parser.add_argument("--profile-dump", metavar="PATH",
+                        help="save frame times to a .csv or .json file on exit")
+    args = parser.parse_args()
+
     pygame.init()
     screen = pygame.display.set_mode((1280, 720))
     states = {"MENU": MenuScreen(), "GAMEPLAY": Gameplay(),
               "LOAD MAP": LoadMap(), "MAP EDITOR": MapEditor()}
-    game = Game(states, "MENU")
+    profiler = FrameProfiler(args.profile or bool(args.profile_log)
+                             or bool(args.profile_dump),
+                             log_interval=args.profile_log)
+    game = Game(states, "MENU", profiler)
+    game.profile_dump = args.profile_dump
     game.run()
     pygame.quit()
     sys.exit()
@@ -1,8 +1,25 @@
+import time
 import pygame
-import math
+import numpy as np
 from gamestates.gamestate import GameState
+import protocol
 from client import Client
-from vector import Vector
+from mapsync import MapSync
+from maps.chunkedmap import ChunkedMap
+from vector import Vector, VectorArray
+from render.camera import Camera
+from render.raycaster import RayHits, cast_rays
+from render.distancefield import DistanceField
+from render.floorcast import FloorCaster
+from render.parallel import ParallelCaster
+from render.rasterizer import Rasterizer, wall_spans
+from render.resolution import ResolutionController, scaled_width
+from render.sprites import sprite_stripes
+from render.textures import WallTextures
+
+# Seconds without a position from another player before they're taken to
+# have left. The relay doesn't say when a player disconnects.
+PLAYER_TIMEOUT = 3.0
 
 
 class Gameplay(GameState):
@@ -16,27 +33,115 @@ class Gameplay(GameState):
         self.moveSpeed = 5.0
         self.rotSpeed = 3.0
 
+        # Cast rays with the batched NumPy engine instead of the scalar loop.
+        # Toggled with V in game to compare the two.
+        self.vectorized = True
+        self.rasterizer = Rasterizer()
+        # Tables of per-column camera values for the current screen size.
+        self.camera = Camera()
+
+        # Number of workers rays are cast on in bands of columns, 1 casts the
+        # whole screen on the main thread. Workers are threads unless
+        # render_processes is set.
+        self.render_workers = 1
+        self.render_processes = False
+        self.caster = None
+        # Connection to the server, only made in multiplayer mode.
+        self.client = None
+
+        # Skip across empty space with a distance field of the map. Gives the
+        # same frame but is faster on large open maps.
+        self.empty_space_skipping = False
+        self.field = None
+        # RayHits of the last frame drawn.
+        self.hits = None
+        # Draw walls with textures instead of flat red. Toggled with T.
+        self.textured_walls = True
+        self.wall_textures = WallTextures()
+        # Cast a textured floor and ceiling instead of leaving them black.
+        # Off by default so its cost can be measured on its own. Toggled
+        # with F.
+        self.floor_casting = False
+        self.floor_caster = FloorCaster()
+        # (position, colour) of every sprite in the world other than the
+        # players, e.g. pickups and props.
+        self.sprites = []
+
+        # Cast rays for fewer columns than the screen has and stretch the frame
+        # to fit it. render_scale is the fraction of columns drawn unless
+        # dynamic_resolution is set, when the controller picks it every frame
+        # to keep the draw time to frame_budget of each frame at Game.fps.
+        # Toggled with R.
+        self.render_scale = 1.0
+        self.dynamic_resolution = False
+        self.resolution = ResolutionController()
+        self.frame_budget = 0.75
+        # Show the columns drawn and recent draw times. Toggled with O.
+        self.resolution_overlay = False
+        # Surface frames are drawn to before being stretched to the screen.
+        self.internal_surface = None
+
+        # Signature of everything the last frame drawn depended on. If it's
+        # the same next frame the frame buffer is shown again as it is.
+        self.frame_signature = None
+        self.reused_frames = 0
+
     def startup(self, persistent):
         super().startup(persistent)
         self.worldMap = self.persist["map"]
         self.spawn_point = self.persist["spawn_point"]
         self.pos = Vector(self.spawn_point[0], self.spawn_point[1])
 
-        # If the game is in multiplayer mode then set the position of a player
-        # 2 and create a client instance.
+        if isinstance(self.worldMap, ChunkedMap):
+            # Load the tiles around the spawn point so the first frame isn't
+            # all walls.
+            self.worldMap.load_around(self.pos)
+
+        # If the game is in multiplayer mode then create a client instance.
         if self.persist["multi_flag"]:
-            self.player2_pos = Vector(15, 15)
             self.client = Client()
-            # Message to be sent to the other player.
-            self.message = {"client id": self.client.id, "pos": self.player2_pos,
-                            "map": self.worldMap}
+            # Tracks the cells of this player's map the other player hasn't
+            # been sent yet.
+            self.map_sync = MapSync(self.worldMap)
+            # Latest position of every other player, keyed by client ID.
+            self.other_players = {}
+            # When each other player's latest position arrived.
+            self.last_seen = {}
+            # Whether player 1's map has been asked for and not received yet.
+            self.map_requested = False
 
         # Hide the mouse cursor as it is not needed in gameplay.
         pygame.mouse.set_visible(False)
 
+    def cleanup(self):
+        # Disconnect so the client's threads and queues don't outlive the
+        # game, and other players see this one leave.
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        # Stop the render workers and free the map they share. A new caster
+        # is made when rays are next cast in parallel.
+        if self.caster is not None:
+            self.caster.close()
+            self.caster = None
+
+    def get_event(self, event):
+        super().get_event(event)
+
+        # Toggle keys are checked here instead of in update() so the setting
+        # they control only switches once per key press.
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_v:
+            self.vectorized = not self.vectorized
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_t:
+            self.textured_walls = not self.textured_walls
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+            self.floor_casting = not self.floor_casting
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_r:
+            self.dynamic_resolution = not self.dynamic_resolution
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_o:
+            self.resolution_overlay = not self.resolution_overlay
+
     def update(self, dt):
-        # Print FPS
-        # print(dt)
         dt /= 1000
         # moveSpeed and rotSpeed are * dt so the player doesn't move/ turn
         # faster/ slower when the game's framerate increases/ decreases.
@@ -47,15 +152,17 @@ class Gameplay(GameState):
         if keys[pygame.K_ESCAPE]:
             self.done = True
 
+        oldPos = Vector(self.pos.x, self.pos.y)
+
         if keys[pygame.K_w]:
             # Move forward in the direction the player is facing by a certain
             # amount (moveSpeed).
             # int() to round pos and index 2D array correctly
             newPos = (self.pos + self.dir*self.moveSpeed)
             # If statements check if where the player is moving to is empty.
-            if self.worldMap[int(newPos.x)][int(self.pos.y)] <= 0:
+            if self.worldMap.get(int(newPos.x), int(self.pos.y)) <= 0:
                 self.pos.x = newPos.x
-            if self.worldMap[int(self.pos.x)][int(newPos.y)] <= 0:
+            if self.worldMap.get(int(self.pos.x), int(newPos.y)) <= 0:
                 self.pos.y = newPos.y
 
         if keys[pygame.K_s]:
@@ -64,82 +171,151 @@ class Gameplay(GameState):
             # int() to round pos and index 2D array correctly
             newPos = (self.pos - self.dir*self.moveSpeed)
             # If statements check if where the player is moving to is empty.
-            if self.worldMap[int(newPos.x)][int(self.pos.y)] <= 0:
+            if self.worldMap.get(int(newPos.x), int(self.pos.y)) <= 0:
                 self.pos.x = newPos.x
-            if self.worldMap[int(self.pos.x)][int(newPos.y)] <= 0:
+            if self.worldMap.get(int(self.pos.x), int(newPos.y)) <= 0:
                 self.pos.y = newPos.y
 
         if keys[pygame.K_d]:
-            # Direction of the player and plane vector rotated by multiplying
-            # their x and y components by the rotation matrix:
-            # [ cos(Θ) -sin(Θ) ]
-            # [ sin(Θ)  cos(Θ) ]
-            # Where Θ is the angle to rotate by.
-            # Θ = -rotSpeed
+            # Rotate the direction of the player and the camera plane to the
+            # right in place.
             # self.rotSpeed is made negative in order to rotate to the right.
-
-            self.dir.x, self.dir.y = (
-                (self.dir.x*math.cos(-self.rotSpeed)
-                 - self.dir.y*math.sin(-self.rotSpeed)),
-                (self.dir.x*math.sin(-self.rotSpeed)
-                 + self.dir.y*math.cos(-self.rotSpeed))
-                )
-
-            self.plane.x, self.plane.y = (
-                (self.plane.x*math.cos(-self.rotSpeed)
-                 - self.plane.y*math.sin(-self.rotSpeed)),
-                (self.plane.x*math.sin(-self.rotSpeed)
-                 + self.plane.y*math.cos(-self.rotSpeed))
-            )
+            self.dir.rotate(-self.rotSpeed)
+            self.plane.rotate(-self.rotSpeed)
 
         if keys[pygame.K_a]:
-            # Direction of the player and plane vector rotated by multiplying
-            # their x and y components by the rotation matrix:
-            # [ cos(Θ) -sin(Θ) ]
-            # [ sin(Θ)  cos(Θ) ]
-            # Where Θ is the angle to rotate by.
-            # Θ = rotSpeed
+            # Rotate the direction of the player and the camera plane to the
+            # left in place.
             # self.rotSpeed is left positive in order to rotate to the left.
+            self.dir.rotate(self.rotSpeed)
+            self.plane.rotate(self.rotSpeed)
 
-            self.dir.x, self.dir.y = (
-                (self.dir.x*math.cos(self.rotSpeed)
-                 - self.dir.y*math.sin(self.rotSpeed)),
-                (self.dir.x*math.sin(self.rotSpeed)
-                 + self.dir.y*math.cos(self.rotSpeed))
-                )
-
-            self.plane.x, self.plane.y = (
-                (self.plane.x*math.cos(self.rotSpeed)
-                 - self.plane.y*math.sin(self.rotSpeed)),
-                (self.plane.x*math.sin(self.rotSpeed)
-                 + self.plane.y*math.cos(self.rotSpeed))
-            )
+        if isinstance(self.worldMap, ChunkedMap):
+            # Ask for the tiles around the player, and where they're heading,
+            # before any rays reach them.
+            velocity = (self.pos - oldPos) / dt if dt else Vector(0, 0)
+            self.worldMap.prefetch(self.pos, velocity)
 
         # If in multiplayer mode.
         if self.persist["multi_flag"]:
-            # Change the pos sent in the message to the current player position.
-            self.message["pos"] = self.pos
-            # Send the other player the message (client ID, pos, map)
-            self.client.send(self.message)
-            # Receive the message from the other player.
-            received = self.client.receive()
+            with self.profiler.phase("net send"):
+                # If this is player 1 send the other player any cells that
+                # have changed since last frame. Sent before the position so
+                # the version in the position message is never ahead of the
+                # other player's map.
+                if self.is_player_1():
+                    delta = self.map_sync.delta()
+                    if delta is not None:
+                        self.client.send(protocol.encode_map_delta(
+                            self.client.id, self.worldMap, *delta))
+                # Send the other player the current player position and the
+                # version and hash of the map.
+                self.client.send(protocol.encode_position(
+                    self.client.id, self.pos, self.worldMap))
+            with self.profiler.phase("net receive"):
+                # Handle every message that has arrived from the other players
+                # since last frame without waiting for any more. Their latest
+                # positions are used until newer ones arrive.
+                for received in self.client.receive_all():
+                    self.handle_message(received)
+                self.expire_players()
+
+    def expire_players(self):
+        """Forget other players whose positions have stopped arriving."""
+        now = time.monotonic()
+        for client_id, seen in list(self.last_seen.items()):
+            if now - seen > PLAYER_TIMEOUT:
+                del self.other_players[client_id]
+                del self.last_seen[client_id]
+
+    def player_1_id(self):
+        """
+        Return the ID of player 1, whose map every player uses. Player 1 is
+        the client with the lowest ID.
+        """
+        return min([self.client.id, *self.other_players])
+
+    def is_player_1(self):
+        """Return True if this client is player 1 and has other players."""
+        return bool(self.other_players) and self.player_1_id() == self.client.id
+
+    def request_map(self):
+        """Ask player 1 for their whole map unless it's already been asked for."""
+        if not self.map_requested:
+            self.client.send(protocol.encode_map_request(self.client.id))
+            self.map_requested = True
+
+    def handle_message(self, received):
+        """Handle a message received from another player or the server."""
+        if received["type"] == protocol.SNAPSHOT:
+            # A snapshot from the server holds every other connected player,
+            # so any player not in it has left.
+            self.other_players = {}
+            self.last_seen = {}
+            for player in received["players"]:
+                self.handle_message(player)
+            return
+
+        if received["type"] == protocol.POSITION:
+            self.other_players[received["client id"]] = received["pos"]
+            self.last_seen[received["client id"]] = time.monotonic()
+
+        # Only a player whose position has arrived can be player 1, so no
+        # message counts as coming from player 1 before any have.
+        from_player_1 = (bool(self.other_players)
+                         and received["client id"] != self.client.id
+                         and received["client id"] == self.player_1_id())
+
+        if received["type"] == protocol.POSITION:
+            # If the other client is player 1 and their map is different then
+            # ask for it. This happens when joining and if a change was lost.
+            if (from_player_1
+                    and received["hash"] != self.worldMap.content_hash()):
+                self.request_map()
+        elif received["type"] == protocol.MAP_REQUEST:
+            # Only send the whole map when another player asks for it, and
+            # only if this is player 1 as every other copy would be thrown
+            # away. The asker counts even if its position hasn't arrived.
+            if self.client.id == min(self.player_1_id(), received["client id"]):
+                self.client.send(protocol.encode_map(self.client.id,
+                                                     self.worldMap))
+                self.map_sync.mark_synced()
+        elif received["type"] == protocol.MAP and from_player_1:
             # If the other client is player 1 then use their map.
-            other_client_id = received["client id"]
-            if other_client_id < self.client.id:
-                self.worldMap = received["map"]
-            # Set player 2's position to the position player 2 has sent.
-            self.player2_pos = received["pos"]
-
-    def draw(self, surface):
-        """Raycasting rendering algorithm of the game."""
-        surface.fill(pygame.Color("black"))
+            self.worldMap = received["map"]
+            self.map_sync = MapSync(self.worldMap)
+            self.map_requested = False
+        elif received["type"] == protocol.MAP_DELTA and from_player_1:
+            # Apply player 1's changes if they were made on top of this
+            # version of the map, otherwise ask for the whole map again.
+            if received["base version"] != self.worldMap.version:
+                self.request_map()
+                return
+            try:
+                self.worldMap.apply_changes(received["indexes"],
+                                            received["values"],
+                                            received["version"])
+            except IndexError:
+                self.request_map()
+                return
+            # Keep the distance field up to date.
+            if self.field is not None and self.field.map is self.worldMap:
+                self.field.update_cells(received["indexes"])
+            if received["hash"] != self.worldMap.content_hash():
+                self.request_map()
+
+    def cast_scalar(self, w):
+        """
+        Cast a ray for every x pixel of the screen one column at a time and
+        return the results in the same form as the batched engine.
+        """
+        hits = RayHits([], [], [], [], [])
+
+        # Look cells up in the flat view of the map directly to avoid a method
+        # call per DDA step.
+        flat = self.worldMap.flat
+        width = self.worldMap.width
 
-        # List to keep track of the distance from the player to drawn stripes
-        # of walls.
-        ZBuffer = []
-
-        w = surface.get_width()
-        h = surface.get_height()
         # For every x pixel of the screen.
         for x in range(w):
             # Convert the x coord of the screen to x coord of the camera plane
@@ -168,6 +344,7 @@ class Gameplay(GameState):
 
             hit = 0
             side = 0
+            steps = 0
 
             # If the ray is pointing to the left.
             if rayDir.x < 0:
@@ -208,6 +385,7 @@ class Gameplay(GameState):
                 sideDistY = (mapPos.y + 1 - self.pos.y) * deltaDistY
 
             while hit == 0:
+                steps += 1
                 # Modified DDA algorithm.
                 # Move the ray a certain amount in either the X or Y direction
                 # depending on which direction has already been travelled the
@@ -224,7 +402,7 @@ class Gameplay(GameState):
                     side = 1    # Y side hit
 
                 # If the where the ray is isn't empty then set hit to 1.
-                if self.worldMap[mapPos.x][mapPos.y] >= 1:
+                if flat[mapPos.x*width + mapPos.y] >= 1:
                     hit = 1
 
             # if the X side of a wall is hit
@@ -254,93 +432,171 @@ class Gameplay(GameState):
 
             perpWallDist += 0.001   # stop zero division error
 
-            lineHeight = int(h / perpWallDist)
-
-            # if above top of screen
-            drawStart = -lineHeight / 2 + h / 2
-            if drawStart < 0:
-                drawStart = 0
-
-            # if below bottom of screen
-            drawEnd = lineHeight / 2 + h / 2
-            if drawEnd >= h:
-                drawEnd = h - 1
-
-            wallColour = pygame.Color("red")
-            pygame.draw.line(surface, wallColour, (x, drawStart), (x, drawEnd))
-
-            ZBuffer.append(perpWallDist)
+            hits.perp_wall_dist.append(perpWallDist)
+            hits.side.append(side)
+            hits.map_x.append(mapPos.x)
+            hits.map_y.append(mapPos.y)
+            hits.steps.append(steps)
+
+        return hits
+
+    def distance_field(self):
+        """
+        Return a distance field of the current world map, reusing the one
+        kept up to date by the map editor if it is for this map.
+        """
+        if self.field is None or self.field.map is not self.worldMap:
+            field = self.persist.get("distance_field")
+            if field is not None and field.map is self.worldMap:
+                self.field = field
+            else:
+                self.field = DistanceField(self.worldMap)
+        return self.field
+
+    def parallel_caster(self):
+        """
+        Return the parallel caster, recreating it if the worker settings have
+        changed since it was made.
+        """
+        if (self.caster is None
+                or self.caster.workers != self.render_workers
+                or self.caster.processes != self.render_processes):
+            if self.caster is not None:
+                self.caster.close()
+            self.caster = ParallelCaster(self.render_workers,
+                                         self.render_processes)
+        return self.caster
+
+    def signature(self, surface, sprites):
+        """
+        Return a tuple of everything a frame drawn to a surface depends on,
+        which is cheap to make and compare. Settings that don't change the
+        picture, like the raycasting engine, are left out.
+        """
+        return (self.pos.coords(), self.dir.coords(), self.plane.coords(),
+                self.worldMap.version, self.worldMap.content_hash(),
+                surface.get_size(), self.textured_walls, self.floor_casting,
+                tuple((pos.x, pos.y, tuple(colour)) for pos, colour in sprites))
 
-        # If in multiplayer mode draw a sprite for player 2.
+    def draw(self, surface):
+        """
+        Draw a frame to a surface, casting rays for fewer columns and
+        stretching the frame to fit if the render scale is below 1.
+        """
+        start = time.perf_counter()
+        w, h = surface.get_size()
+        scale = (self.resolution.scale if self.dynamic_resolution
+                 else self.render_scale)
+        columns = scaled_width(w, scale)
+
+        if columns == w:
+            self.render(surface)
+        else:
+            if (self.internal_surface is None
+                    or self.internal_surface.get_size() != (columns, h)):
+                self.internal_surface = pygame.Surface((columns, h), 0,
+                                                       surface)
+            self.render(self.internal_surface)
+            pygame.transform.scale(self.internal_surface, (w, h), surface)
+
+        # Frame times are always recorded so they can be shown, but the
+        # scale is only changed if dynamic resolution is on.
+        draw_ms = (time.perf_counter() - start) * 1000
+        target_ms = None
+        if self.dynamic_resolution:
+            target_ms = 1000 / self.fps * self.frame_budget
+        self.resolution.update(draw_ms, target_ms)
+
+        if self.resolution_overlay:
+            self.draw_resolution_overlay(surface, columns)
+
+    def draw_resolution_overlay(self, surface, columns):
+        """Draw the number of columns drawn and recent draw times."""
+        stats = self.resolution.stats()
+        text = (f"{columns}/{surface.get_width()} columns  "
+                f"draw {stats['mean']:.1f} ms  p95 {stats['p95']:.1f} ms")
+        surface.blit(self.body_font.render(text, True, pygame.Color("white")),
+                     (10, 10))
+
+    def render(self, surface):
+        """Raycasting rendering algorithm of the game."""
+        # Draw the other players as sprites along with any other sprites.
+        sprites = self.sprites
         if self.persist["multi_flag"]:
-            # WORLD SPACE
-            # Find relative position of the sprite.
-            sprite = self.player2_pos - self.pos
-
-            # stop zero division error
-            if sprite.x == 0:
-                sprite.x += 0.001
-            if sprite.y == 0:
-                sprite.y += 0.001
-
-            # CAMERA SPACE
-            # Inverse the camera matrix to get a view matrix
-            invDet = 1 / (self.plane.x*self.dir.y - self.dir.x*self.plane.y)
-
-            # X coord - in camera space
-            transformX = invDet * (self.dir.y*sprite.x - self.dir.x*sprite.y)
-            # Y coord - in camera space
-            transformY = invDet * (-self.plane.y*sprite.x + self.plane.x*sprite.y)
-
-            # VIEWPORT SPACE (camera plane coords)
-            # cameraPlaneCoord = transformX / transformY
-            # SCREEN SPACE (pixels)
-            # (w / 2) * (1 + cameraPlaneCoord) - translating and scaling the
-            # camera plane coords -1 -> 0 --> 1
-            # to pixels coords 0 --> 640 --> 1280
-            spriteScreenX = int((w / 2) * (1 + transformX / transformY))
-
-            spriteWidth = abs(int(h / transformY))
-            spriteHeight = abs(int(h / transformY))
-
-            # Find start and end draw points for the sprite from its centre
-            # (spriteScreenX).
-            drawStartX = -spriteWidth / 2 + spriteScreenX
-            # If drawStartX is beyond the left of the screen set drawStartX to
-            # the left of the screen
-            if drawStartX < 0:
-                drawStartX = 0
-
-            # If drawEndX is beyond the right of the screen set drawEndX to
-            # the right of the screen
-            drawEndX = spriteWidth / 2 + spriteScreenX
-            if drawEndX >= w:
-                drawEndX = w - 1
-
-            # If drawStartY is beyond the top of the screen set drawStartY to
-            # the top of the screen
-            drawStartY = -spriteHeight / 2 + h / 2
-            if drawStartY < 0:
-                drawStartY = 0
-
-            # If drawEndY is beyond the bottom of the screen set drawEndY to
-            # the bottom of the screen
-            drawEndY = spriteHeight / 2 + h / 2
-            if drawEndY >= h:
-                drawEndY = h - 1
-
-            drawStartX = int(drawStartX)
-            drawEndX = int(drawEndX)
-            drawStartY = int(drawStartY)
-            drawEndY = int(drawEndY)
-            for stripe in range(drawStartX, drawEndX):
-                # transformY > 0 check if infront of the camera
-                infront_camera = transformY > 0
-                # transformY < ZBuffer[stripe] check if stripe is infront of a wall
-                # if the distance to the sprite is less than the wall then
-                # the sprite is infront.
-                infront_wall = transformY < ZBuffer[stripe]
-
-                if infront_camera and infront_wall:
-                    pygame.draw.line(surface, (0, 255, 0), (stripe, drawStartY),
-                                     (stripe, drawEndY))
+            sprites = sprites + [(pos, (0, 255, 0))
+                                 for pos in self.other_players.values()]
+
+        # If nothing has changed since the last frame, e.g. the player is
+        # standing still, show the last frame again instead of drawing it.
+        # It's still copied to the surface in case anything was drawn over it.
+        signature = self.signature(surface, sprites)
+        if (signature == self.frame_signature
+                and self.rasterizer.reuse(surface)):
+            self.reused_frames += 1
+            self.rasterizer.end()
+            return
+        self.frame_signature = signature
+
+        # Every wall and sprite stripe of the frame is written into the
+        # rasterizer's frame buffer which is then copied to the surface once.
+        self.rasterizer.begin(surface, pygame.Color("black"))
+
+        # Only rebuilt when the screen size changes.
+        self.camera.resize(surface.get_size())
+        w = self.camera.w
+        h = self.camera.h
+
+        # Cast every ray either with the batched NumPy engine or the original
+        # scalar loop so their output and speed can be compared.
+        # Chunked worlds are always cast with the batched engine on this
+        # thread, as their cells are looked up through their tile cache
+        # rather than one array, and without a distance field of the whole
+        # map.
+        chunked = isinstance(self.worldMap, ChunkedMap)
+        field = None
+        if self.empty_space_skipping and not chunked:
+            field = self.distance_field()
+        if self.vectorized and self.render_workers > 1 and not chunked:
+            hits = self.parallel_caster().cast(self.worldMap, self.pos,
+                                               self.dir, self.plane,
+                                               self.camera.camera_x, field)
+        elif self.vectorized or chunked:
+            hits = cast_rays(self.worldMap, self.pos, self.dir, self.plane,
+                             self.camera.camera_x, field)
+        else:
+            hits = self.cast_scalar(w)
+        self.hits = hits
+
+        # Array to keep track of the distance from the player to drawn stripes
+        # of walls.
+        ZBuffer = np.asarray(hits.perp_wall_dist)
+
+        if self.floor_casting:
+            self.floor_caster.draw(self.rasterizer, self.pos, self.dir,
+                                   self.plane, self.camera.camera_x, h,
+                                   ZBuffer)
+
+        if self.textured_walls:
+            self.wall_textures.draw(self.rasterizer, self.worldMap, hits,
+                                    self.pos, self.dir, self.plane,
+                                    self.camera.camera_x, h)
+        else:
+            drawStart, drawEnd = wall_spans(h, ZBuffer)
+            self.rasterizer.spans(drawStart, drawEnd, pygame.Color("red"))
+
+        if sprites:
+            self.draw_sprites(sprites, ZBuffer, h)
+
+        self.rasterizer.end()
+
+    def draw_sprites(self, sprites, ZBuffer, h):
+        """
+        Draw a list of (position, colour) sprites in one batch, hidden behind
+        any closer walls.
+        """
+        positions = VectorArray.from_vectors([pos for pos, _ in sprites])
+        stripes = sprite_stripes(positions, self.pos, self.dir, self.plane,
+                                 ZBuffer, h)
+        pixels = self.rasterizer.map_colours([colour for _, colour in sprites])
+        self.rasterizer.column_spans(stripes.x, stripes.drawStart,
+                                     stripes.drawEnd, pixels[stripes.sprite])
@@ -1,4 +1,6 @@
 import pygame
+from maps.gridmap import GridMap
+from profiler import FrameProfiler
 
 new_map = [
     [1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1],
@@ -35,10 +37,14 @@ class GameState:
         self.done = False
         self.quit = False
         self.next_state = None
+        # Frame rate the game runs at and the profiler timing each frame,
+        # both set by Game.
+        self.fps = 60
+        self.profiler = FrameProfiler()
         self.screen = pygame.display.get_surface()
         self.screen_rect = self.screen.get_rect()
         self.screen_center_x = self.screen_rect.centerx
-        self.persist = {"map": new_map, "spawn_point": (22, 12), "multi_flag": 0}
+        self.persist = {"map": GridMap.from_list(new_map), "spawn_point": (22, 12), "multi_flag": 0}
         self.title_font = pygame.font.SysFont('consolas', 36, True)
         self.sub_font = pygame.font.SysFont('consolas', 24, True)
         self.body_font = pygame.font.SysFont('consolas', 18, True)
@@ -47,6 +53,13 @@ class GameState:
         self.persist = persistent
         self.done = False
 
+    def cleanup(self):
+        """
+        Called when the game leaves the state or exits, to release anything
+        the state started, e.g. connections and threads.
+        """
+        pass
+
     def get_event(self, event):
         if event.type == pygame.QUIT:
             self.quit = True
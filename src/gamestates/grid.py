@@ -1,14 +1,53 @@
+import numpy as np
 import pygame
+from maps.journal import EditJournal
+from render.distancefield import DistanceField
 
 screen = pygame.display.set_mode((0, 0), pygame.FULLSCREEN)
 
 
+def line_cells(start, end):
+    """
+    Return every (row, col) cell on the line from one cell to another,
+    including both ends, with Bresenham's line algorithm.
+    """
+    (row, col), (end_row, end_col) = start, end
+    d_row = abs(end_row - row)
+    d_col = -abs(end_col - col)
+    step_row = 1 if row < end_row else -1
+    step_col = 1 if col < end_col else -1
+    error = d_row + d_col
+
+    cells = [(row, col)]
+    while (row, col) != (end_row, end_col):
+        double_error = 2*error
+        if double_error >= d_col:
+            error += d_col
+            row += step_row
+        if double_error <= d_row:
+            error += d_row
+            col += step_col
+        cells.append((row, col))
+    return cells
+
+
 class Grid:
+    # Colour each cell value is drawn in. Any other value is drawn as a wall.
+    colors = {-1: pygame.Color("green"), 0: pygame.Color("white"),
+              1: pygame.Color("red")}
+    # What each draw mode fills cells with.
+    modes = {"draw": 1, "erase": 0,  "set spawn": -1}
+
     def __init__(self, map, cell_size, cell_gap_size):
-        # List comprehension to make a copy instead of referencing original object.
-        self.map = [list(x) for x in map]
-        self.cells_x = len(self.map[0])
-        self.cells_y = len(self.map)
+        # Make a copy instead of referencing original object.
+        self.map = map.copy()
+        # Distance field of the map for the raycaster, brought up to date by
+        # update_field() once per stroke rather than on every cell painted.
+        self.field = DistanceField(self.map)
+        # Flat indexes of the cells changed since the field was last updated.
+        self.field_changes = []
+        self.cells_x = self.map.width
+        self.cells_y = self.map.height
         self.cell_size = cell_size
         self.cell_gap_size = cell_gap_size
         self.grid_width = (self.cells_x*cell_size + (self.cells_x*cell_gap_size
@@ -18,101 +57,193 @@ class Grid:
         self.grid_rect = pygame.Rect((0, 0, self.grid_width, self.grid_height))
         self.grid_surface = pygame.Surface(self.grid_rect.size)
 
-        # List to keep track of coordinates of cells modified in last mouse press
-        self.recent_cell_indexes = []
-        # Stack of lists of coordinates of cells modified in different mouse presses
-        self.clicked_cells = []
-
-        self.cells = [[] for y in range(self.cells_y)]
+        # Journal of the changes made, one entry per mouse press or reset,
+        # to undo and redo them.
+        self.journal = EditJournal()
+
+        # 2D array of the rect of each cell on grid_surface, [row][col]. Made
+        # once as the cells never move on the grid.
+        self.cells = [[pygame.Rect(x*(cell_size + cell_gap_size),
+                                   y*(cell_size + cell_gap_size),
+                                   cell_size, cell_size)
+                       for x in range(self.cells_x)]
+                      for y in range(self.cells_y)]
+
+        # (row, col) of every cell changed since grid_surface was last drawn
+        # on. grid_surface is kept between frames and only these cells are
+        # repainted, so a frame where nothing changes is a single blit.
+        self.dirty = set()
+        self.paint_all()
+
+        # (row, col) of the spawn cell, or None if it isn't set, kept up to
+        # date as cells change so the map doesn't need searching for it.
+        self.spawn = self.map.find(-1)
+        # Cell the mouse was last over while its button was held down, so
+        # cells skipped over by a fast drag can be filled in.
+        self.last_cell = None
 
     def align(self, surface):
-        """Move the center of each cell to where it has actually been drawn."""
-        surface_width = surface.get_width()
-        surface_height = surface.get_height()
-        for row in self.cells:
-            for cell in row:
-                cell["rect"].centerx += surface_width // 2 - self.grid_width // 2
-                cell["rect"].centery += surface_height // 2 - self.grid_height // 2
-        self.grid_rect.center = surface_width // 2, surface_height // 2
+        """Centre the grid on a surface."""
+        self.grid_rect.center = (surface.get_width() // 2,
+                                 surface.get_height() // 2)
+
+    def paint_all(self):
+        """Paint every cell of the grid onto grid_surface."""
+        for y in range(self.cells_y):
+            for x in range(self.cells_x):
+                self.paint(y, x)
+        self.dirty.clear()
+
+    def paint(self, row, col):
+        """Paint one cell onto grid_surface in the colour of its value."""
+        color = self.colors.get(self.map.get(row, col), self.colors[1])
+        self.grid_surface.fill(color, self.cells[row][col])
+
+    def set_cell(self, row, col, value):
+        """
+        Set a cell of the map, recording the change in the journal and keeping
+        the spawn and the cells to repaint up to date. The distance field is
+        updated when the stroke ends.
+        """
+        index = row*self.cells_x + col
+        self.journal.record(index, self.map.get(row, col), value)
+        self.map.set(row, col, value)
+        self.field_changes.append(index)
+        self.dirty.add((row, col))
+        if value == -1:
+            self.spawn = (row, col)
+        elif self.spawn == (row, col):
+            self.spawn = None
+
+    def apply_changes(self, indexes, values):
+        """
+        Set the cells at flat indexes (row*width + col) to values, e.g. to undo
+        or redo them, without recording the change.
+        """
+        self.map.apply_changes(indexes, values, self.map.version + 1)
+        rows, cols = np.divmod(indexes, self.cells_x)
+        self.dirty.update(zip(rows.tolist(), cols.tolist()))
+
+        # Keep the distance field up to date, along with any cells of a
+        # stroke still in progress.
+        self.field_changes.extend(np.asarray(indexes).tolist())
+        self.update_field()
+
+        # Keep track of the spawn from only the cells that changed.
+        if (self.spawn is not None
+                and self.map.get(*self.spawn) != -1):
+            self.spawn = None
+        spawns = np.flatnonzero(np.asarray(values) == -1)
+        if len(spawns):
+            self.spawn = (int(rows[spawns[-1]]), int(cols[spawns[-1]]))
+
+    def update_field(self):
+        """Update the distance field for every cell changed since last called."""
+        if self.field_changes:
+            self.field.update_cells(self.field_changes)
+            self.field_changes = []
+
+    def end_stroke(self):
+        """
+        Finish the current stroke: every cell it changed is undone together
+        and the distance field is updated for them all at once.
+        """
+        self.journal.commit()
+        self.update_field()
+
+    def cell_at(self, pos):
+        """
+        Return the (row, col) of the cell at a position on the screen, or None
+        if it's outside the grid or in a gap between cells. Worked out from
+        the grid's position and cell size so it's quick for any size of map.
+        """
+        x = pos[0] - self.grid_rect.x
+        y = pos[1] - self.grid_rect.y
+        if not (0 <= x < self.grid_width and 0 <= y < self.grid_height):
+            return None
+        pitch = self.cell_size + self.cell_gap_size
+        col, offset_x = divmod(x, pitch)
+        row, offset_y = divmod(y, pitch)
+        if offset_x >= self.cell_size or offset_y >= self.cell_size:
+            return None
+        return row, col
 
     def draw(self, surface):
-        """Draw the grid from scratch every frame."""
-
-        # Reset 2D array of cells
-        self.cells = [[] for y in range(self.cells_y)]
-
-        colors = {"empty": pygame.Color("white"), "wall": pygame.Color("red"),
-                  "spawn": pygame.Color("green")}
-        types = {-1: "spawn", 0: "empty", 1: "wall"}
-
-        # Create and add cells to the 2D cells array.
-        for y, row in enumerate(self.map):
-            for x, ele in enumerate(row):
-                rect = pygame.Rect(x*(self.cell_size + self.cell_gap_size),
-                                   y*(self.cell_size + self.cell_gap_size),
-                                   self.cell_size, self.cell_size)
-                cell = {"rect": rect, "type": types[1],
-                        "color": colors[types[ele]]}
-                self.cells[y].append(cell)
-
-        # Draw the cells of the grid to a surface.
-        for row in self.cells:
-            for cell in row:
-                pygame.draw.rect(self.grid_surface, cell["color"], cell["rect"])
+        """Repaint any changed cells then draw the grid to a surface."""
+        for row, col in self.dirty:
+            self.paint(row, col)
+        self.dirty.clear()
 
         self.align(surface)
         surface.blit(self.grid_surface, self.grid_rect)
 
     def undo(self):
-        """Undo every changed cell since the mouse button was held down."""
-        # Check cells have been modified
-        if self.clicked_cells:
-            # Get coords of all modified cells
-            for coords in self.clicked_cells[-1]:
-                i = coords[0]
-                j = coords[1]
-                # Reverse fill of cell
-                self.map[j][i] = int(not self.map[j][i])
-
-            # Remove undone cells from the modified cells stack.
-            self.clicked_cells.pop()
+        """Undo the last mouse press or reset that changed any cells."""
+        changes = self.journal.undo()
+        if changes is not None:
+            self.apply_changes(*changes)
+
+    def redo(self):
+        """Redo the last change undone."""
+        changes = self.journal.redo()
+        if changes is not None:
+            self.apply_changes(*changes)
 
     def reset(self):
         """Reset every cell in map to a fill of 0 excluding the border cells."""
-        # [1:-1] and enumerate starts at 1 so border cells not affected
-        for j, row in enumerate(self.cells[1:-1], 1):
-            for i, cell in enumerate(row[1:-1], 1):
-                # Only set fill of cell to 0 if cell isn't already 0
-                if self.map[j][i]:
-                    self.map[j][i] = 0
-                    # add reset cells to recently change cells list
-                    self.recent_cell_indexes.append((i, j))
+        # Only cells that aren't already 0 are set. Border cells are masked
+        # out so they're not affected.
+        filled = self.map.cells != 0
+        filled[[0, -1], :] = False
+        filled[:, [0, -1]] = False
+        indexes = np.flatnonzero(filled)
+        if not len(indexes):
+            return
+        values = np.zeros(len(indexes), dtype=np.int8)
+        # The whole reset is one journal entry, separate from any stroke.
+        self.journal.commit()
+        self.journal.record_many(indexes, self.map.cells.reshape(-1)[indexes],
+                                 values)
+        self.journal.commit()
+        self.apply_changes(indexes, values)
 
     def cell_clicked(self, surface, mode):
         """
         Check if a cell has been clicked and then fill it depending on the
         current drawing mode: drawing walls, erasing or setting the spawn.
         """
-        # Check if spawn already set and if it is return
-        if mode == "set spawn":
-            if any(-1 in row for row in self.map):
+        # The stroke ends when the left mouse button is let go.
+        if not pygame.mouse.get_pressed()[0]:
+            self.last_cell = None
+            return
+
+        mouse_pos = pygame.mouse.get_pos()
+        if not self.grid_rect.collidepoint(mouse_pos):
+            self.last_cell = None
+            return
+        cell = self.cell_at(mouse_pos)
+        # In a gap between cells, so wait for the mouse to reach the next one.
+        if cell is None:
+            return
+
+        # Fill every cell between where the mouse was last frame and where it
+        # is now, so moving it quickly doesn't leave gaps. Setting the spawn
+        # only ever fills the cell under the mouse.
+        if self.last_cell is None or mode == "set spawn":
+            cells = [cell]
+        else:
+            cells = line_cells(self.last_cell, cell)
+        self.last_cell = cell
+
+        # Change what the cell will be filled with based on the draw mode.
+        fill = self.modes[mode]
+        for j, i in cells:
+            # Border cells not affected
+            if not (0 < j < self.cells_y - 1 and 0 < i < self.cells_x - 1):
+                continue
+            # Check if spawn already set and if it is return
+            if fill == -1 and self.spawn is not None:
                 return
-
-        # If left mouse button pressed
-        if pygame.mouse.get_pressed()[0]:
-            mouse_pos = pygame.mouse.get_pos()
-
-            # Change what the cell will be filled with based on the draw mode.
-            modes = {"draw": 1, "erase": 0,  "set spawn": -1}
-            fill = modes[mode]
-            # [1:-1] and enumerate start at 1 so border cells not affected
-            for j, row in enumerate(self.cells[1:-1], 1):
-                for i, cell in enumerate(row[1:-1], 1):
-                    # If mouse pointer is in a cell.
-                    if cell["rect"].collidepoint(mouse_pos):
-                        # Check if a change is actually being made to the cell.
-                        if fill != self.map[j][i]:
-                            self.map[j][i] = fill
-                            # Add the coordinates of the cell modified to the
-                            # recently modified cells list.
-                            self.recent_cell_indexes.append((i, j))
+            # Check if a change is actually being made to the cell.
+            if fill != self.map.get(j, i):
+                self.set_cell(j, i, fill)
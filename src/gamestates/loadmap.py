@@ -1,9 +1,11 @@
 import pygame
-import pickle
 from tkinter import filedialog
 from gamestates.gamestate import GameState
 from gamestates.button import Button
 from maps.example_maps import default_map
+from maps.gridmap import GridMap
+from maps.chunkedmap import ChunkedMap, ChunkFileError, is_chunk_file
+from maps.mapfile import MapFileError, import_map
 
 class LoadMap(GameState):
     def __init__(self):
@@ -28,33 +30,24 @@ class LoadMap(GameState):
         """Open a map from a file into the map variable."""
         file_path = filedialog.askopenfilename()    # Run an open file dialog.
         if file_path:   # Check if a file has actually been loaded.
-            with open(file_path, "rb") as fp:
-                map = pickle.load(fp)
-                return map
+            # Old pickled maps are converted as they're loaded. Chunk files
+            # are streamed from the file as they're played.
+            try:
+                if is_chunk_file(file_path):
+                    return ChunkedMap(file_path)
+                return import_map(file_path)
+            except (MapFileError, ChunkFileError, OSError) as error:
+                print(f"Couldn't load {file_path}: {error}")
 
-    def has_border(self, map):
-        """If the map has a border of 1s return True if not return False."""
-        # True if the first row is all 1s, otherwise False.
-        first_row = all(map[0])
-        # True if the last row is all 1s, otherwise False.
-        last_row = all(map[-1])
-        # True if the first number of every row is a 1, otherwise False.
-        first_ele = all([row[0] for row in map])
-        # True if the last number of every row is a 1, otherwise False.
-        last_ele = all([row[-1] for row in map])
-
-        return first_row and last_row and first_ele and last_ele
-
-    def add_border(self, map):
-        """Add a border of 1s around the map."""
-        # Add a row of 1s to the start of the map array.
-        map.insert(0, [1 for i in range(len(map[0]))])
-        # Add a row of 1s to the end of the map array.
-        map.append([1 for i in range(len(map[0]))])
-        # For every row in the map array add a 1 to the start and end of it.
-        for row in map:
-            row.insert(0, 1)
-            row.append(1)
+    def set_map(self, map):
+        """
+        Make map the map every state uses, closing the chunked world it
+        replaces, if it was one, so its file and loader thread don't leak.
+        """
+        old_map = self.persist["map"]
+        if isinstance(old_map, ChunkedMap) and old_map is not map:
+            old_map.close()
+        self.persist["map"] = map
 
     def startup(self, persistent):
         super().startup(persistent)
@@ -66,15 +59,39 @@ class LoadMap(GameState):
 
         if self.buttons["existing map"].button_clicked(event):
             map = self.open_map()
-            if map:                            # Check if map has been loaded
-                if not self.has_border(map):
-                    self.add_border(map)
+            self.next_state = "MAP EDITOR"
+            if isinstance(map, ChunkedMap):
+                # Chunked worlds are too big to edit so they're played
+                # straight away, from the centre of their spawn cell. They
+                # can't be shared as the map messages hold every cell, so
+                # they're refused in multiplayer and the load screen stays
+                # open.
+                if map.spawn is None:
+                    print(f"{map.path} has no spawn point.")
+                    map.close()
+                    return
+                if self.persist["multi_flag"]:
+                    print(f"{map.path} is a chunked world, which can't be "
+                          "played in multiplayer.")
+                    map.close()
+                    return
+                self.set_map(map)
+                self.persist["spawn_point"] = (map.spawn[0] + 0.5,
+                                               map.spawn[1] + 0.5)
+                self.next_state = "GAMEPLAY"
+            elif map is not None:              # Check if map has been loaded
+                if not map.has_border():
+                    map = map.add_border()
 
-                self.persist["map"] = map
+                self.set_map(map)
+            elif isinstance(self.persist["map"], ChunkedMap):
+                # Nothing was loaded and the chunked world can't be edited.
+                self.next_state = "MENU"
 
             self.done = True
         elif self.buttons["default map"].button_clicked(event):
-            self.persist["map"] = default_map
+            self.next_state = "MAP EDITOR"
+            self.set_map(GridMap.from_list(default_map))
             self.done = True
         elif self.buttons["menu"].button_clicked(event):
             self.next_state = "MENU"
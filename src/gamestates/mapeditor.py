@@ -1,9 +1,9 @@
 import pygame
-import pickle
 from tkinter import filedialog
 from gamestates.gamestate import GameState
 from gamestates.button import Button
 from gamestates.grid import Grid
+from maps.mapfile import save_map
 
 class MapEditor(GameState):
     def __init__(self):
@@ -20,7 +20,7 @@ class MapEditor(GameState):
         instructions_str = [
             "Press:",
             " - D to draw, E to erase, P to set spawn,",
-            " - Z to undo, R to reset, S to save state,",
+            " - Z to undo, Y to redo, R to reset, S to save state,",
             " - CTRL + S to save file, ESC for main menu."
             ]
 
@@ -62,26 +62,28 @@ class MapEditor(GameState):
         Find what position in the 2D array has been set to -1 (spawn)
         and set the spawn point variable to its position in the array.
         """
-        for j, row in enumerate(self.grid.map):
-            for i, cell in enumerate(row):
-                if cell == -1:
-                    self.spawn_point = (j+1, i+1)
-                    self.persist["spawn_point"] = self.spawn_point
+        spawn = self.grid.spawn
+        if spawn is not None:
+            j, i = spawn
+            self.spawn_point = (j+1, i+1)
+            self.persist["spawn_point"] = self.spawn_point
 
     def save_state(self):
         """Save the state of the grid map to the persistent map array."""
-        # A list comprehension is used so changing self.grid.map doesn't directly
-        # change self.persist["map"] without save_state() being called.
-        self.persist["map"] = [list(x) for x in self.grid.map]
+        # A copy is used so changing self.grid.map doesn't directly change
+        # self.persist["map"] without save_state() being called.
+        self.grid.update_field()
+        self.persist["map"] = self.grid.map.copy()
+        self.persist["distance_field"] = self.grid.field.copy(
+            self.persist["map"])
         self.set_spawn()
 
     def save_file(self):
-        """Save the map array to a file."""
+        """Save the map to a binary map file."""
         self.save_state()
         file_path = filedialog.asksaveasfilename()  # run a save file dialog
         if file_path:   # check if a file is actually being saved to
-            with open(file_path, "wb") as fp:
-                pickle.dump(self.persist["map"], fp)
+            save_map(file_path, self.persist["map"], self.grid.spawn)
 
     def startup(self, persistent):
         super().startup(persistent)
@@ -96,18 +98,17 @@ class MapEditor(GameState):
         super().get_event(event)
 
         if event.type == pygame.MOUSEBUTTONUP:
-            # If any cells have been modified since mouse button was held down
-            # then add those cells to the modified cells stack.
-            if self.grid.recent_cell_indexes:
-                self.grid.clicked_cells.append(self.grid.recent_cell_indexes)
-            # Reset list of cells modified since mouse button has been pressed.
-            self.grid.recent_cell_indexes = []
-
-        # Z key is checked here instead of in update() so only one undo happens
-        # per key press.
+            # Every cell modified since the mouse button was held down is
+            # undone together.
+            self.grid.end_stroke()
+
+        # Z and Y keys are checked here instead of in update() so only one
+        # undo or redo happens per key press.
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_z:
                 self.grid.undo()
+            elif event.key == pygame.K_y:
+                self.grid.redo()
 
         if self.buttons["draw"].button_clicked(event):
             self.draw_mode = "draw"
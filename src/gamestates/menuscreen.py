@@ -1,6 +1,7 @@
 import pygame
 from gamestates.gamestate import GameState
 from gamestates.button import Button
+from maps.chunkedmap import ChunkedMap
 
 class MenuScreen(GameState):
     def __init__(self):
@@ -44,6 +45,12 @@ class MenuScreen(GameState):
             self.next_state = "GAMEPLAY"
             self.done = True
         elif self.buttons["multi"].button_clicked(event):
+            # Chunked worlds can't be shared as the map messages hold every
+            # cell, so multiplayer can't be turned on while one is loaded.
+            if (not self.persist["multi_flag"]
+                    and isinstance(self.persist["map"], ChunkedMap)):
+                print("Chunked worlds can't be played in multiplayer.")
+                return
             # Make multi_flag the opposite of what it already is:
             # i.e. 0 --> 1 or 1 --> 0
             self.persist["multi_flag"] = not self.persist["multi_flag"]
@@ -57,8 +64,10 @@ class MenuScreen(GameState):
             self.next_state = "LOAD MAP"
             self.done = True
         elif self.buttons["map editor"].button_clicked(event):
-            self.next_state = "MAP EDITOR"
-            self.done = True
+            # Chunked worlds are too big to edit.
+            if not isinstance(self.persist["map"], ChunkedMap):
+                self.next_state = "MAP EDITOR"
+                self.done = True
         elif self.buttons["exit"].button_clicked(event):
             self.quit = True
 
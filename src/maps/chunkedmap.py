@@ -0,0 +1,419 @@
+"""
+Chunked world for maps too big to keep in memory. The map is split into
+square tiles saved in a chunk file and only the tiles near the player, or
+that rays reach, are kept in a fixed size cache. Tiles are read from the file
+on a background thread and count as walls until they've loaded.
+
+A chunk file is a header followed by a table of every tile and then the
+cells of the tiles:
+
+    magic        4 bytes  b"RCCK"
+    version      uint16   FORMAT_VERSION of the format the file was saved in
+    flags        uint16   (none yet)
+    width        uint32   cells across
+    height       uint32   cells down
+    tile size    uint32   cells along each side of a tile, a power of 2
+    spawn row    int32    row of the spawn cell, -1 if the map has none
+    spawn col    int32    col of the spawn cell, -1 if the map has none
+    tiles        uint64   number of tiles, tiles down * tiles across
+    checksum     8 bytes  blake2b digest of the tile table
+    (padding)    4 bytes
+
+    offsets      tiles int64   where each tile's cells start in the file, or
+                               -1 if every cell of the tile is the same
+    fills        tiles int8    value of every cell of the tiles stored as -1
+
+Tiles are numbered row by row. Each stored tile is tile size * tile size int8
+cells row by row, with the cells of edge tiles past the edge of the map set
+to 1. Every number is little-endian. Maps are converted to chunk files by
+running this module, e.g. from a memory-mapped binary map file:
+
+    python -m maps.chunkedmap "maps/big.rcmap" "maps/big.rcchunk"
+"""
+import argparse
+import hashlib
+import queue
+import struct
+import threading
+
+import numpy as np
+
+MAGIC = b"RCCK"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIIiiQ8s4x")
+HEADER_SIZE = HEADER.size
+
+
+class ChunkFileError(Exception):
+    """Raised when a chunk file is damaged or isn't a chunk file."""
+
+
+def is_chunk_file(path):
+    """Return True if the file at path starts with the chunk file magic."""
+    with open(path, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def table_checksum(offsets, fills):
+    """Return the 8 byte checksum of a tile table saved in the header."""
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(offsets.astype("<i8").tobytes())
+    digest.update(fills.astype(np.int8).tobytes())
+    return digest.digest()
+
+
+def save_chunked(path, cells, tile_size=64, spawn=None):
+    """
+    Save a 2D array of cells indexed [row][col], e.g. GridMap.cells or the
+    memory-mapped cells of a big map file, to a chunk file. The cells are
+    read one row of tiles at a time so the whole map never has to be in
+    memory at once. spawn is the (row, col) of the spawn cell.
+    """
+    if tile_size < 1 or tile_size & (tile_size - 1):
+        raise ValueError("Tile size must be a power of 2.")
+    height, width = cells.shape
+    tiles_down = -(-height // tile_size)
+    tiles_across = -(-width // tile_size)
+    tiles = tiles_down * tiles_across
+    offsets = np.full(tiles, -1, dtype=np.int64)
+    fills = np.zeros(tiles, dtype=np.int8)
+    spawn_row, spawn_col = (-1, -1) if spawn is None else spawn
+
+    with open(path, "wb") as fp:
+        # The header and table are written again once the offsets are known.
+        fp.write(bytes(HEADER_SIZE + tiles*9))
+        offset = fp.tell()
+        for tile_row in range(tiles_down):
+            r0 = tile_row * tile_size
+            band = np.ones((tile_size, tiles_across * tile_size),
+                           dtype=np.int8)
+            rows = np.asarray(cells[r0:r0 + tile_size], dtype=np.int8)
+            band[:len(rows), :width] = rows
+            for tile_col in range(tiles_across):
+                tile = band[:, tile_col*tile_size:(tile_col + 1)*tile_size]
+                index = tile_row*tiles_across + tile_col
+                first = tile[0, 0]
+                if (tile == first).all():
+                    fills[index] = first
+                    continue
+                offsets[index] = offset
+                fp.write(np.ascontiguousarray(tile).tobytes())
+                offset += tile.size
+
+        fp.seek(0)
+        fp.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, width, height,
+                             tile_size, spawn_row, spawn_col, tiles,
+                             table_checksum(offsets, fills)))
+        fp.write(offsets.astype("<i8").tobytes())
+        fp.write(fills.tobytes())
+
+
+class ChunkedMap:
+    """
+    Map whose cells are looked up through a cache of up to max_tiles tiles
+    read from a chunk file. With threads=False missing tiles are read as
+    soon as they're needed instead of on a background thread, so lookups
+    never see a tile that hasn't loaded.
+
+    Only reading cells is supported, e.g. map[rows, cols] or get(row, col),
+    as there is no array of every cell.
+    """
+    def __init__(self, path, max_tiles=1024, threads=True):
+        self.path = path
+        self.fp = open(path, "rb")
+        data = self.fp.read(HEADER_SIZE)
+        if len(data) < HEADER_SIZE:
+            raise ChunkFileError("File too short for a chunk header.")
+        (magic, version, _, self.width, self.height, self.tile_size,
+         spawn_row, spawn_col, tiles, digest) = HEADER.unpack(data)
+        if magic != MAGIC:
+            raise ChunkFileError("Not a chunk file.")
+        if version > FORMAT_VERSION:
+            raise ChunkFileError(f"Chunk file version {version} is newer "
+                                 f"than {FORMAT_VERSION}.")
+        size = self.tile_size
+        if size < 1 or size & (size - 1):
+            raise ChunkFileError("Tile size isn't a power of 2.")
+        self.spawn = None if spawn_row < 0 else (spawn_row, spawn_col)
+        # Tile coords of a cell are its coords shifted right by shift, and
+        # its coords within the tile are its coords & mask.
+        self.shift = size.bit_length() - 1
+        self.mask = size - 1
+        self.tiles_down = -(-self.height // size)
+        self.tiles_across = -(-self.width // size)
+        if tiles != self.tiles_down * self.tiles_across:
+            raise ChunkFileError("Chunk file has the wrong number of tiles.")
+
+        self.offsets = np.frombuffer(self.fp.read(tiles*8), dtype="<i8")
+        self.fills = np.frombuffer(self.fp.read(tiles), dtype=np.int8)
+        if (len(self.fills) != tiles
+                or table_checksum(self.offsets, self.fills) != digest):
+            raise ChunkFileError("Chunk file tile table is damaged.")
+        # Value of every cell of a tile that isn't in the cache: the fill of
+        # tiles that are all one value, which never need to be read, and a
+        # wall for the rest until they've loaded.
+        self.missing = np.where(self.offsets < 0, self.fills, 1).astype(np.int8)
+
+        # The cache is a fixed block of slots so it never takes up more
+        # memory, and looking up many cells is a few array operations: the
+        # slot of each cell's tile, then the cell within the slot.
+        self.max_tiles = max_tiles
+        self.pool = np.ones((max_tiles, size, size), dtype=np.int8)
+        # Slot of every tile, -1 if it isn't cached, and tile in every slot.
+        self.slots = np.full(tiles, -1, dtype=np.int32)
+        self.slot_tiles = np.full(max_tiles, -1, dtype=np.int64)
+        # Tick each slot was last looked up in. The tick goes up with every
+        # lookup and prefetch so the order slots were used in is kept
+        # whoever calls them, and the slot used longest ago is reused when
+        # the cache is full.
+        self.last_used = np.zeros(max_tiles, dtype=np.int64)
+        self.free = list(range(max_tiles - 1, -1, -1))
+        self.tick = 0
+
+        # Goes up by one every time a tile loads as that changes what the
+        # map looks like, like GridMap.version does when a cell is set.
+        self.version = 0
+        self.hash = int.from_bytes(digest, "big")
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+        # Tiles asked for that haven't loaded yet. Tiles that couldn't be read
+        # stay in it so they stay walls and aren't asked for again.
+        self.requested = set()
+        self.threads = threads
+        self.loader = None
+        if threads:
+            self.load_queue = queue.Queue()
+            self.loaded_queue = queue.Queue()
+            self.loader = threading.Thread(target=self.load_tiles, daemon=True)
+            self.loader.start()
+
+    @property
+    def shape(self):
+        return self.height, self.width
+
+    def __len__(self):
+        return self.height
+
+    def content_hash(self):
+        """Return a 64 bit hash of the chunk file's tile table."""
+        return self.hash
+
+    def read_tile(self, fp, tile):
+        """Read the cells of a stored tile from an open chunk file."""
+        size = self.tile_size
+        fp.seek(int(self.offsets[tile]))
+        data = fp.read(size * size)
+        if len(data) != size * size:
+            raise ChunkFileError("Chunk file is missing cells.")
+        return np.frombuffer(data, dtype=np.int8).reshape(size, size)
+
+    def load_tiles(self):
+        """Read the tiles asked for on the loader thread until closed."""
+        with open(self.path, "rb") as fp:
+            while True:
+                tile = self.load_queue.get()
+                if tile is None:
+                    return
+                try:
+                    cells = self.read_tile(fp, tile)
+                except (OSError, ChunkFileError):
+                    cells = None
+                self.loaded_queue.put((tile, cells))
+
+    def install(self, tile, cells):
+        """Put a tile's cells in a slot, evicting the least recently used."""
+        if cells is None:
+            return
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot = int(np.argmin(self.last_used))
+            self.slots[self.slot_tiles[slot]] = -1
+            self.evictions += 1
+        self.pool[slot] = cells
+        self.slots[tile] = slot
+        self.slot_tiles[slot] = tile
+        self.last_used[slot] = self.tick
+        self.requested.discard(tile)
+        self.loads += 1
+        self.version += 1
+
+    def poll(self):
+        """Move the tiles the loader thread has read into the cache."""
+        if not self.threads:
+            return
+        while True:
+            try:
+                tile, cells = self.loaded_queue.get_nowait()
+            except queue.Empty:
+                return
+            # A tile can be read twice if it was evicted and asked for again
+            # before the first read arrived.
+            if self.slots[tile] < 0:
+                self.install(tile, cells)
+
+    def request(self, tiles):
+        """Ask for tiles to be loaded if they aren't cached or on their way."""
+        for tile in tiles:
+            if (tile in self.requested or self.slots[tile] >= 0
+                    or self.offsets[tile] < 0):
+                continue
+            self.requested.add(tile)
+            if self.threads:
+                self.load_queue.put(tile)
+            else:
+                try:
+                    cells = self.read_tile(self.fp, tile)
+                except (OSError, ChunkFileError):
+                    cells = None
+                self.install(tile, cells)
+
+    def tiles_around(self, row, col, radius):
+        """
+        Return the tiles within radius tiles of the tile holding cell
+        (row, col), nearest first, skipping any off the map.
+        """
+        tile_row = int(row) >> self.shift
+        tile_col = int(col) >> self.shift
+        offsets = np.arange(-radius, radius + 1)
+        rows, cols = np.meshgrid(offsets + tile_row, offsets + tile_col,
+                                 indexing="ij")
+        rows = rows.ravel()
+        cols = cols.ravel()
+        order = np.argsort(np.maximum(abs(rows - tile_row),
+                                      abs(cols - tile_col)), kind="stable")
+        rows = rows[order]
+        cols = cols[order]
+        on_map = ((rows >= 0) & (rows < self.tiles_down)
+                  & (cols >= 0) & (cols < self.tiles_across))
+        return (rows[on_map] * self.tiles_across + cols[on_map]).tolist()
+
+    def load_around(self, pos, radius=1):
+        """
+        Read the tiles within radius tiles of a position straight away, e.g.
+        around the spawn point before the first frame.
+        """
+        threads = self.threads
+        self.threads = False
+        try:
+            self.request(self.tiles_around(pos.x, pos.y, radius))
+        finally:
+            self.threads = threads
+
+    def prefetch(self, pos, velocity, radius=1, lookahead=1.0):
+        """
+        Called once a frame with the player's position and velocity in cells
+        per second. Asks for the tiles within radius tiles of the player and
+        of where they'll be in lookahead seconds if they keep moving, so
+        tiles usually load before any ray reaches them.
+        """
+        self.tick += 1
+        self.poll()
+        self.request(self.tiles_around(pos.x, pos.y, radius))
+        ahead = pos + velocity*lookahead
+        if (int(ahead.x) >> self.shift, int(ahead.y) >> self.shift) != \
+                (int(pos.x) >> self.shift, int(pos.y) >> self.shift):
+            self.request(self.tiles_around(ahead.x, ahead.y, radius))
+
+    def lookup(self, rows, cols):
+        """
+        Return the values of the cells at arrays of rows and cols, which must
+        be on the map. Cells of tiles that haven't loaded are walls, and
+        their tiles are asked for.
+        """
+        self.tick += 1
+        self.poll()
+        rows = np.asarray(rows, dtype=np.intp)
+        cols = np.asarray(cols, dtype=np.intp)
+        tiles = (rows >> self.shift) * self.tiles_across + (cols >> self.shift)
+        slots = self.slots[tiles]
+        values = self.missing[tiles]
+        loaded = slots >= 0
+        if loaded.any():
+            used = slots[loaded]
+            self.hits += used.size
+            values[loaded] = self.pool[used, rows[loaded] & self.mask,
+                                       cols[loaded] & self.mask]
+            self.last_used[used] = self.tick
+        if loaded.all():
+            return values
+
+        wanted = tiles[~loaded]
+        wanted = wanted[self.offsets[wanted] >= 0]
+        self.misses += wanted.size
+        if self.threads:
+            self.request(np.unique(wanted).tolist())
+            return values
+        # Each tile's cells are looked up as soon as it's read, as reading
+        # the next one could evict it if more tiles are needed than fit.
+        for tile in np.unique(wanted).tolist():
+            self.request([tile])
+            slot = self.slots[tile]
+            if slot >= 0:
+                cells = tiles == tile
+                values[cells] = self.pool[slot, rows[cells] & self.mask,
+                                          cols[cells] & self.mask]
+        return values
+
+    def get(self, row, col):
+        """Return the value of the cell at map[row][col]."""
+        if not (0 <= row < self.height and 0 <= col < self.width):
+            return 1
+        return int(self.lookup([row], [col])[0])
+
+    def __getitem__(self, index):
+        """Return the values of the cells at map[rows, cols]."""
+        if not isinstance(index, tuple) or len(index) != 2:
+            raise TypeError("Chunked map cells are looked up with "
+                            "map[rows, cols].")
+        return self.lookup(*index)
+
+    def stats(self):
+        """
+        Return a dict of the cell lookups that hit and missed the cache, the
+        hit rate, tiles loaded and evicted, tiles held and cache bytes.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit rate": self.hits / lookups if lookups else None,
+                "loads": self.loads, "evictions": self.evictions,
+                "tiles": self.max_tiles - len(self.free),
+                "bytes": self.pool.nbytes}
+
+    def close(self):
+        """Stop the loader thread and close the chunk file."""
+        if self.loader is not None:
+            self.load_queue.put(None)
+            self.loader.join()
+            self.loader = None
+        self.fp.close()
+
+
+def main():
+    """Convert a map to a chunk file from the command line."""
+    from maps.mapfile import import_map, is_map_file, read_header
+    parser = argparse.ArgumentParser(
+        description="Convert a map file or pickled map to a chunk file.")
+    parser.add_argument("source", help="map to convert")
+    parser.add_argument("destination", help="chunk file to save")
+    parser.add_argument("--tile-size", type=int, default=64,
+                        help="cells along each side of a tile, a power of 2")
+    args = parser.parse_args()
+    map = import_map(args.source)
+    # Map files already say where the spawn is, which saves searching a map
+    # that might not fit in memory for it.
+    if is_map_file(args.source):
+        with open(args.source, "rb") as fp:
+            spawn = read_header(fp).spawn
+    else:
+        spawn = map.find(-1)
+    save_chunked(args.destination, map.cells, args.tile_size, spawn)
+    print(f"Converted {map.width}x{map.height} map to {args.destination}")
+
+
+if __name__ == "__main__":
+    main()
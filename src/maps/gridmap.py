@@ -0,0 +1,120 @@
+"""
+Compact map type storing every cell of a map as one signed byte.
+"""
+import hashlib
+import numpy as np
+
+
+class GridMap:
+    def __init__(self, width, height, cells=None, version=0):
+        """
+        Create a map width cells across and height cells down. cells is an
+        optional array of shape (height, width), otherwise every cell is 0.
+        """
+        self.width = width
+        self.height = height
+        if cells is None:
+            cells = np.zeros((height, width), dtype=np.int8)
+        # 2D array indexed [row][col] like the list of lists maps.
+        self.cells = np.ascontiguousarray(cells, dtype=np.int8)
+        # Flat signed char view of the same memory. Indexing a memoryview
+        # returns a plain int, which is much faster than indexing the array
+        # for looking up a single cell.
+        self.flat = memoryview(self.cells).cast("b")
+        # Goes up by one every time a cell is changed with set() so copies of
+        # the map elsewhere (e.g. other players') can tell they're out of date.
+        self.version = version
+        # Content hash and the version it was worked out for.
+        self.hash = None
+        self.hash_version = None
+
+    @classmethod
+    def from_list(cls, map):
+        """Create a GridMap from a list of lists map."""
+        cells = np.array(map, dtype=np.int8)
+        return cls(cells.shape[1], cells.shape[0], cells)
+
+    def to_list(self):
+        """Return the map as a list of lists of ints."""
+        return self.cells.tolist()
+
+    def copy(self):
+        """Return a copy of the map that doesn't share its cells."""
+        return GridMap(self.width, self.height, self.cells.copy(), self.version)
+
+    def get(self, row, col):
+        """Return the value of the cell at map[row][col]."""
+        return self.flat[row*self.width + col]
+
+    def set(self, row, col, value):
+        """Set the value of the cell at map[row][col]."""
+        self.flat[row*self.width + col] = value
+        self.version += 1
+
+    def apply_changes(self, indexes, values, version):
+        """
+        Set the cells at flat indexes (row*width + col) to values and set the
+        map version, e.g. to apply changes made to another copy of the map.
+        """
+        self.cells.reshape(-1)[indexes] = values
+        self.version = version
+
+    def content_hash(self):
+        """Return a 64 bit hash of the size and cells of the map."""
+        if self.hash_version != self.version:
+            digest = hashlib.blake2b(digest_size=8)
+            digest.update(self.width.to_bytes(4, "big"))
+            digest.update(self.height.to_bytes(4, "big"))
+            digest.update(self.cells.tobytes())
+            self.hash = int.from_bytes(digest.digest(), "big")
+            self.hash_version = self.version
+        return self.hash
+
+    def find(self, value):
+        """
+        Return the (row, col) of the last cell with a value, or None if no
+        cell has that value.
+        """
+        rows, cols = np.nonzero(self.cells == value)
+        if rows.size:
+            return int(rows[-1]), int(cols[-1])
+
+    def has_border(self):
+        """If the map has a border of 1s return True if not return False."""
+        # True if the first and last rows and the first and last columns are
+        # all 1s, otherwise False.
+        return bool(self.cells[0].all() and self.cells[-1].all()
+                    and self.cells[:, 0].all() and self.cells[:, -1].all())
+
+    def add_border(self):
+        """Return a new map with a border of 1s around this map."""
+        cells = np.pad(self.cells, 1, constant_values=1)
+        return GridMap(self.width + 2, self.height + 2, cells)
+
+    def __getitem__(self, row):
+        """Return a row of the map so map[row][col] still works."""
+        return self.cells[row]
+
+    def __len__(self):
+        return self.height
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def __array__(self, dtype=None, copy=None):
+        """Let NumPy use the cell array directly, e.g. np.asarray(map)."""
+        if dtype is None:
+            return self.cells
+        return self.cells.astype(dtype)
+
+    def __eq__(self, other):
+        if not isinstance(other, GridMap):
+            return NotImplemented
+        return bool(np.array_equal(self.cells, other.cells))
+
+    def __getstate__(self):
+        # memoryviews can't be pickled so only the cells are saved.
+        return self.width, self.height, self.cells, self.version
+
+    def __setstate__(self, state):
+        self.__init__(*state)
@@ -0,0 +1,103 @@
+"""
+Undo and redo journal of the changes made to a GridMap, stored as packed
+arrays so long editing sessions on large maps use little memory.
+"""
+from array import array
+from collections import deque, namedtuple
+
+import numpy as np
+
+# One undoable change to many cells: their flat indexes (row*width + col)
+# and their values before and after it.
+Entry = namedtuple("Entry", ["indexes", "old", "new"])
+
+
+def entry_bytes(entry):
+    """Return the memory used by an entry's arrays in bytes."""
+    return entry.indexes.nbytes + entry.old.nbytes + entry.new.nbytes
+
+
+class EditJournal:
+    """
+    Changes are recorded one cell at a time into the current entry, e.g. one
+    brush stroke, which commit() adds to the undo stack. Once the entries on
+    both stacks take up more than max_bytes the oldest can no longer be
+    undone.
+    """
+    def __init__(self, max_bytes=4 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.bytes = 0
+        # Changes of the entry being recorded.
+        self.indexes = array("I")
+        self.old = array("b")
+        self.new = array("b")
+
+    def record(self, index, old, new):
+        """Record that the cell at a flat index changed from old to new."""
+        self.indexes.append(index)
+        self.old.append(old)
+        self.new.append(new)
+
+    def record_many(self, indexes, old, new):
+        """Record changes to many cells at once from arrays of them."""
+        # Copied across as raw bytes, which match the arrays' item types, so
+        # no Python int is made per cell.
+        self.indexes.frombytes(np.asarray(indexes, dtype=np.uint32).tobytes())
+        self.old.frombytes(np.asarray(old, dtype=np.int8).tobytes())
+        self.new.frombytes(np.asarray(new, dtype=np.int8).tobytes())
+
+    def commit(self):
+        """
+        Finish the entry being recorded and add it to the undo stack, unless
+        nothing was recorded. Anything undone can no longer be redone.
+        """
+        if not self.indexes:
+            return
+        indexes = np.frombuffer(self.indexes, dtype=np.uint32)
+        old = np.frombuffer(self.old, dtype=np.int8)
+        new = np.frombuffer(self.new, dtype=np.int8)
+        # A cell changed more than once is stored once, with its value
+        # before the first change and after the last.
+        unique, first = np.unique(indexes, return_index=True)
+        _, last_reversed = np.unique(indexes[::-1], return_index=True)
+        last = len(indexes) - 1 - last_reversed
+        entry = Entry(unique, old[first].copy(), new[last].copy())
+
+        self.indexes = array("I")
+        self.old = array("b")
+        self.new = array("b")
+
+        for undone in self.redo_stack:
+            self.bytes -= entry_bytes(undone)
+        self.redo_stack.clear()
+        self.undo_stack.append(entry)
+        self.bytes += entry_bytes(entry)
+        # Forget the oldest entries, always keeping the newest one.
+        while self.bytes > self.max_bytes and len(self.undo_stack) > 1:
+            self.bytes -= entry_bytes(self.undo_stack.popleft())
+
+    def undo(self):
+        """
+        Return (indexes, values) to set to undo the newest entry, or None if
+        there's nothing to undo.
+        """
+        self.commit()
+        if not self.undo_stack:
+            return None
+        entry = self.undo_stack.pop()
+        self.redo_stack.append(entry)
+        return entry.indexes, entry.old
+
+    def redo(self):
+        """
+        Return (indexes, values) to set to redo the newest entry undone, or
+        None if there's nothing to redo.
+        """
+        self.commit()
+        if not self.redo_stack:
+            return None
+        entry = self.redo_stack.pop()
+        self.undo_stack.append(entry)
+        return entry.indexes, entry.new
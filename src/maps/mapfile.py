@@ -0,0 +1,196 @@
+"""
+Binary map file format. A map file is a fixed size header followed by the
+cells:
+
+    magic        4 bytes  b"RCMP"
+    version      uint16   FORMAT_VERSION of the format the file was saved in
+    flags        uint16   COMPRESSED if the cells are zlib compressed
+    width        uint32   cells across
+    height       uint32   cells down
+    dtype        uint8    type of one cell, INT8 (signed byte)
+    (padding)    3 bytes
+    spawn row    int32    row of the spawn cell, -1 if the map has none
+    spawn col    int32    col of the spawn cell, -1 if the map has none
+    size         uint64   bytes of cell data after the header
+    checksum     8 bytes  blake2b digest of the uncompressed cells
+    (padding)    4 bytes
+
+followed by the width * height cells row by row, as stored in GridMap.cells,
+or those bytes zlib compressed. Every number is little-endian.
+
+Uncompressed files are memory-mapped straight into the map's cell array, so
+loading one doesn't parse anything per cell and only the pages of the file
+that are used are read. The old maps saved as a pickled list of lists can
+still be loaded with import_map() and converted by running this module:
+
+    python -m maps.mapfile "maps/default map.txt" "maps/default map.rcmap"
+"""
+import argparse
+import hashlib
+import pickle
+import struct
+import zlib
+from collections import namedtuple
+
+import numpy as np
+
+from maps.gridmap import GridMap
+
+MAGIC = b"RCMP"
+FORMAT_VERSION = 1
+
+# Flags.
+COMPRESSED = 1
+
+# Cell dtypes and the codes they're saved as.
+INT8 = 1
+DTYPES = {INT8: np.int8}
+
+HEADER = struct.Struct("<4sHHIIB3xiiQ8s4x")
+HEADER_SIZE = HEADER.size
+
+Header = namedtuple("Header", ["version", "flags", "width", "height", "dtype",
+                               "spawn", "size", "checksum"])
+
+
+class MapFileError(Exception):
+    """Raised when a map file is damaged or isn't a map file."""
+
+
+def checksum(cells):
+    """Return the 8 byte checksum of a cell array saved in the header."""
+    return hashlib.blake2b(np.ascontiguousarray(cells), digest_size=8).digest()
+
+
+def is_map_file(path):
+    """Return True if the file at path starts with the map file magic."""
+    with open(path, "rb") as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def read_header(fp):
+    """Read and check the header at the start of an open binary file."""
+    data = fp.read(HEADER_SIZE)
+    if len(data) < HEADER_SIZE:
+        raise MapFileError("File too short for a map header.")
+    (magic, version, flags, width, height, dtype, spawn_row, spawn_col, size,
+     digest) = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise MapFileError("Not a map file.")
+    if version > FORMAT_VERSION:
+        raise MapFileError(f"Map file version {version} is newer than "
+                           f"{FORMAT_VERSION}.")
+    if dtype not in DTYPES:
+        raise MapFileError(f"Unknown cell dtype {dtype}.")
+    if not width or not height:
+        raise MapFileError("Map has no cells.")
+    if not flags & COMPRESSED and size != width * height:
+        raise MapFileError("Map file has the wrong number of cells.")
+    spawn = None if spawn_row < 0 else (spawn_row, spawn_col)
+    return Header(version, flags, width, height, dtype, spawn, size, digest)
+
+
+def save_map(path, map, spawn=None, compress=False):
+    """
+    Save a GridMap to a map file. spawn is the (row, col) of the spawn cell,
+    by default the cell set to -1 if there is one. The cells are zlib
+    compressed if compress is True, which makes the file smaller but means
+    it can't be memory-mapped when loaded.
+    """
+    if spawn is None:
+        spawn = map.find(-1)
+    spawn_row, spawn_col = (-1, -1) if spawn is None else spawn
+    cells = np.ascontiguousarray(map.cells, dtype=np.int8)
+    data = zlib.compress(cells) if compress else memoryview(cells).cast("B")
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, COMPRESSED if compress else 0,
+                         map.width, map.height, INT8, spawn_row, spawn_col,
+                         len(data), checksum(cells))
+    with open(path, "wb") as fp:
+        fp.write(header)
+        fp.write(data)
+
+
+def load_map(path, verify=True):
+    """
+    Load a GridMap from a map file. The cells of an uncompressed file are
+    memory-mapped copy-on-write, so the map can still be edited without
+    changing the file. If verify is True the checksum is checked, which
+    reads every cell once.
+    """
+    with open(path, "rb") as fp:
+        header = read_header(fp)
+        shape = (header.height, header.width)
+        if header.flags & COMPRESSED:
+            try:
+                data = zlib.decompress(fp.read(header.size))
+            except zlib.error as error:
+                raise MapFileError("Map file cells are damaged.") from error
+            if len(data) != header.width * header.height:
+                raise MapFileError("Map file has the wrong number of cells.")
+            cells = np.frombuffer(data, dtype=DTYPES[header.dtype])
+            # frombuffer() of bytes is read only.
+            cells = cells.reshape(shape).copy()
+        else:
+            fp.seek(0, 2)
+            if fp.tell() < HEADER_SIZE + header.size:
+                raise MapFileError("Map file is missing cells.")
+            cells = np.memmap(fp, dtype=DTYPES[header.dtype], mode="c",
+                              offset=HEADER_SIZE, shape=shape)
+    if verify and checksum(cells) != header.checksum:
+        raise MapFileError("Map file checksum doesn't match its cells.")
+    return GridMap(header.width, header.height, cells)
+
+
+class _ListUnpickler(pickle.Unpickler):
+    """
+    Unpickler for the old list of lists maps. Lists and ints are pickled
+    without any globals so refusing every global stops a file from running
+    code when it's loaded.
+    """
+    def find_class(self, module, name):
+        raise MapFileError(f"Pickled map contains {module}.{name}.")
+
+
+def load_pickled(path):
+    """Load a GridMap from an old map file of a pickled list of lists."""
+    with open(path, "rb") as fp:
+        try:
+            map = _ListUnpickler(fp).load()
+        except (pickle.UnpicklingError, EOFError) as error:
+            raise MapFileError("Not a pickled map.") from error
+    try:
+        return GridMap.from_list(map)
+    except (TypeError, ValueError, OverflowError) as error:
+        raise MapFileError("Pickled map isn't a list of lists of cells.") \
+            from error
+
+
+def import_map(path):
+    """Load a GridMap from either a map file or an old pickled map."""
+    if is_map_file(path):
+        return load_map(path)
+    return load_pickled(path)
+
+
+def convert(source, destination, compress=False):
+    """Convert an old pickled map to a map file and return the GridMap."""
+    map = load_pickled(source)
+    save_map(destination, map, compress=compress)
+    return map
+
+
+def main():
+    """Convert old pickled maps to map files from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Convert a pickled list of lists map to a map file.")
+    parser.add_argument("source", help="pickled map to convert")
+    parser.add_argument("destination", help="map file to save")
+    parser.add_argument("--compress", action="store_true",
+                        help="zlib compress the cells")
+    args = parser.parse_args()
+    map = convert(args.source, args.destination, args.compress)
+    print(f"Converted {map.width}x{map.height} map to {args.destination}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Tracks which cells of a map have changed since they were last sent to the
+other players so only those cells need to be sent.
+"""
+import numpy as np
+
+
+class MapSync:
+    def __init__(self, map):
+        self.map = map
+        # Copy of the cells and the version of the map the other players
+        # were last sent.
+        self.synced_cells = map.cells.copy()
+        self.synced_version = map.version
+
+    def mark_synced(self):
+        """Record that the other players have been sent the whole map."""
+        self.synced_cells = self.map.cells.copy()
+        self.synced_version = self.map.version
+
+    def delta(self):
+        """
+        Return (base version, flat indexes, values) of the cells changed since
+        the last delta or full map was sent, or None if nothing has changed.
+        """
+        if self.map.version == self.synced_version:
+            return None
+        indexes = np.flatnonzero(self.map.cells != self.synced_cells)
+        base_version = self.synced_version
+        values = self.map.cells.reshape(-1)[indexes]
+
+        self.synced_cells.reshape(-1)[indexes] = values
+        self.synced_version = self.map.version
+        return base_version, indexes, values
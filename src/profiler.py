@@ -0,0 +1,166 @@
+"""
+Frame profiler that times each phase of every frame, e.g. event handling,
+update, draw and the network, and keeps the times of the most recent frames
+in a ring buffer to show percentiles of.
+"""
+import contextlib
+import csv
+import json
+import time
+
+import numpy as np
+import pygame
+
+# Shared do-nothing context manager handed out while the profiler is off, so
+# timing a phase then costs one method call.
+_NOT_TIMED = contextlib.nullcontext()
+
+
+class _Phase:
+    """Context manager adding the time spent inside it to a phase."""
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+
+
+class FrameProfiler:
+    """
+    Off by default, when timing a phase costs next to nothing. Turned on
+    with enabled, or at runtime with F3 which also shows the overlay.
+    """
+    def __init__(self, enabled=False, capacity=600, log_interval=None):
+        self.enabled = enabled
+        # Show the percentiles of each phase on screen.
+        self.overlay = False
+        # Seconds between the log lines printed, None to not print any.
+        self.log_interval = log_interval
+        self.last_log = time.perf_counter()
+
+        # Milliseconds spent in each phase for the last capacity frames. Row
+        # frame % capacity holds a frame so old frames are overwritten.
+        self.capacity = capacity
+        self.times = {}
+        # Number of frames begun.
+        self.frames = 0
+        self.frame_start = None
+        self.font = None
+
+    def phase(self, name):
+        """
+        Return a context manager that adds the time spent in it to the named
+        phase of the current frame, e.g. with profiler.phase("draw"): ...
+        """
+        if not self.enabled:
+            return _NOT_TIMED
+        return _Phase(self, name)
+
+    def record(self, name, seconds):
+        """Add a time in seconds to the named phase of the current frame."""
+        if not self.enabled or self.frame_start is None:
+            return
+        times = self.times.get(name)
+        if times is None:
+            # Frames from before the phase was first seen are left as NaN so
+            # they're left out of its percentiles.
+            times = self.times[name] = np.full(self.capacity, np.nan)
+        row = (self.frames - 1) % self.capacity
+        if np.isnan(times[row]):
+            times[row] = 0
+        times[row] += seconds * 1000
+
+    def begin_frame(self):
+        """Start timing a new frame."""
+        if not self.enabled:
+            self.frame_start = None
+            return
+        self.frames += 1
+        row = (self.frames - 1) % self.capacity
+        for times in self.times.values():
+            times[row] = np.nan
+        self.frame_start = time.perf_counter()
+
+    def end_frame(self):
+        """Finish timing the current frame, printing a log line if it's due."""
+        if not self.enabled or self.frame_start is None:
+            return
+        now = time.perf_counter()
+        self.record("frame", now - self.frame_start)
+        if (self.log_interval is not None
+                and now - self.last_log >= self.log_interval):
+            self.last_log = now
+            print(self.log_line())
+
+    def rows(self):
+        """Return the rows of the ring buffer holding frames, oldest first."""
+        count = min(self.frames, self.capacity)
+        return (np.arange(self.frames - count, self.frames)) % self.capacity
+
+    def stats(self):
+        """
+        Return a dict of the mean, p50, p95, p99 and max milliseconds of
+        every phase over the recent frames it was timed in.
+        """
+        stats = {}
+        rows = self.rows()
+        for name, times in self.times.items():
+            times = times[rows]
+            times = times[~np.isnan(times)]
+            if not len(times):
+                continue
+            p50, p95, p99 = np.percentile(times, [50, 95, 99])
+            stats[name] = {"mean": float(times.mean()), "p50": float(p50),
+                           "p95": float(p95), "p99": float(p99),
+                           "max": float(times.max())}
+        return stats
+
+    def log_line(self):
+        """Return a one line summary of the p50 and p95 of every phase."""
+        return "  ".join(f"{name} {s['p50']:.2f}/{s['p95']:.2f}ms"
+                         for name, s in self.stats().items())
+
+    def draw_overlay(self, surface):
+        """Draw a table of the percentiles of every phase on a surface."""
+        if not (self.enabled and self.overlay):
+            return
+        if self.font is None:
+            self.font = pygame.font.SysFont('consolas', 14, True)
+        lines = [f"{'phase':<16}{'p50':>7}{'p95':>7}{'p99':>7}{'max':>7}"]
+        for name, s in self.stats().items():
+            lines.append(f"{name:<16}{s['p50']:7.2f}{s['p95']:7.2f}"
+                         f"{s['p99']:7.2f}{s['max']:7.2f}")
+        y = surface.get_height() - len(lines) * self.font.get_linesize() - 10
+        for line in lines:
+            text = self.font.render(line, True, pygame.Color("yellow"),
+                                    pygame.Color("black"))
+            surface.blit(text, (10, y))
+            y += self.font.get_linesize()
+
+    def dump(self, path):
+        """
+        Save the phase times of every recent frame to a CSV file, one row per
+        frame, or if path ends in .json a JSON file of them with the stats.
+        """
+        rows = self.rows()
+        names = list(self.times)
+        frames = {name: [None if np.isnan(t) else float(t)
+                         for t in self.times[name][rows]] for name in names}
+        if path.endswith(".json"):
+            with open(path, "w") as fp:
+                json.dump({"stats": self.stats(), "frames": frames}, fp,
+                          indent=2)
+            return
+        with open(path, "w", newline="") as fp:
+            writer = csv.writer(fp)
+            writer.writerow(names)
+            for i in range(len(rows)):
+                writer.writerow(["" if frames[name][i] is None
+                                 else f"{frames[name][i]:.4f}"
+                                 for name in names])
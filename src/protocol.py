@@ -0,0 +1,239 @@
+"""
+Binary network protocol shared by the client and the server.
+
+Every message is sent as a frame: a 4 byte big-endian length followed by that
+many bytes of payload. Every payload starts with a header:
+
+    type        uint8   POSITION, MAP_REQUEST, MAP, MAP_DELTA, PING, PONG or
+                        SNAPSHOT
+    client id   uint32  id of the client that sent the message, 0 for the
+                        server
+
+followed by a body that depends on the type:
+
+    POSITION     x, y          int32 each, the position * POSITION_SCALE
+                 version       uint32 version of the sender's map
+                 hash          uint64 content hash of the sender's map
+    MAP_REQUEST  (no body)
+    MAP          width         uint32
+                 height        uint32
+                 version       uint32
+                 hash          uint64
+                 cells         width * height int8 cells, row by row
+    MAP_DELTA    base version  uint32 version the changes apply on top of
+                 version       uint32 version after the changes
+                 hash          uint64 hash of the map after the changes
+                 count         uint32
+                 indexes       count uint32 flat cell indexes (row*width + col)
+                 values        count int8 new cell values
+    PING         time          float64 sender's clock when it was sent
+    PONG         to            uint32 client id of the PING's sender
+                 time          float64 time from the PING, sent back
+    SNAPSHOT     count         uint32 number of players
+                 players       count * (client id uint32 + a POSITION body)
+
+so a position update is 29 bytes on the wire. Nothing is pickled, so a peer
+can't make the receiver run code by sending it a message.
+
+PINGs are answered by the server itself with a PONG sent only to the client
+that sent the PING, so neither is ever forwarded to the other clients.
+"""
+import struct
+
+import numpy as np
+
+from maps.gridmap import GridMap
+from vector import Vector
+
+# Message types.
+POSITION = 1
+MAP_REQUEST = 2
+MAP = 3
+MAP_DELTA = 4
+PING = 5
+PONG = 6
+SNAPSHOT = 7
+
+# Client id the server sends its own messages with.
+SERVER_ID = 0
+
+LENGTH = struct.Struct(">I")
+HEADER = struct.Struct(">BI")
+POSITION_BODY = struct.Struct(">iiIQ")
+MAP_BODY = struct.Struct(">IIIQ")
+MAP_DELTA_BODY = struct.Struct(">IIQI")
+PING_BODY = struct.Struct(">d")
+PONG_BODY = struct.Struct(">Id")
+SNAPSHOT_BODY = struct.Struct(">I")
+SNAPSHOT_ENTRY_SIZE = HEADER.size - 1 + POSITION_BODY.size
+
+# Positions are sent as fixed point numbers with 1/1024 of a cell precision.
+POSITION_SCALE = 1024
+
+
+class ProtocolError(Exception):
+    """Raised when a message can't be decoded."""
+
+
+def encode_position(client_id, pos, map):
+    """
+    Return the payload of a position update message, which also holds the
+    version and hash of the sender's GridMap so peers can check theirs.
+    """
+    return (HEADER.pack(POSITION, client_id)
+            + POSITION_BODY.pack(round(pos.x * POSITION_SCALE),
+                                 round(pos.y * POSITION_SCALE),
+                                 map.version, map.content_hash()))
+
+
+def encode_map_request(client_id):
+    """Return the payload of a message asking the other clients for a map."""
+    return HEADER.pack(MAP_REQUEST, client_id)
+
+
+def encode_map(client_id, map):
+    """Return the payload of a message holding a whole GridMap."""
+    return (HEADER.pack(MAP, client_id)
+            + MAP_BODY.pack(map.width, map.height, map.version,
+                            map.content_hash())
+            + map.cells.tobytes())
+
+
+def encode_map_delta(client_id, map, base_version, indexes, values):
+    """
+    Return the payload of a message holding the cells of a GridMap that have
+    changed since base_version.
+    """
+    return (HEADER.pack(MAP_DELTA, client_id)
+            + MAP_DELTA_BODY.pack(base_version, map.version, map.content_hash(),
+                                  len(indexes))
+            + np.asarray(indexes, dtype=">u4").tobytes()
+            + np.asarray(values, dtype=np.int8).tobytes())
+
+
+def encode_ping(client_id, time):
+    """Return the payload of a ping message sent at time."""
+    return HEADER.pack(PING, client_id) + PING_BODY.pack(time)
+
+
+def encode_pong(client_id, to, time):
+    """Return the payload of the reply to a ping from client to sent at time."""
+    return HEADER.pack(PONG, client_id) + PONG_BODY.pack(to, time)
+
+
+def encode_snapshot(entries):
+    """
+    Return the payload of a snapshot of several players. Each entry is the
+    client id and position body of one player made by snapshot_entry().
+    """
+    return (HEADER.pack(SNAPSHOT, SERVER_ID) + SNAPSHOT_BODY.pack(len(entries))
+            + b"".join(entries))
+
+
+def snapshot_entry(payload):
+    """
+    Return the snapshot entry of a player from the payload of a position
+    message they sent, without decoding and re-encoding the position.
+    """
+    # Dropping the type leaves the client id followed by the position body.
+    return payload[1:]
+
+
+def decode(payload):
+    """
+    Decode a payload into a dict with the message "type", the "client id" of
+    the sender and the "pos", "map", "version", "hash" etc. it holds.
+    """
+    if len(payload) < HEADER.size:
+        raise ProtocolError("Message too short.")
+    message_type, client_id = HEADER.unpack_from(payload)
+    message = {"type": message_type, "client id": client_id}
+    body = memoryview(payload)[HEADER.size:]
+
+    if message_type == POSITION:
+        if len(body) != POSITION_BODY.size:
+            raise ProtocolError("Bad position message.")
+        x, y, message["version"], message["hash"] = POSITION_BODY.unpack(body)
+        message["pos"] = Vector(x / POSITION_SCALE, y / POSITION_SCALE)
+    elif message_type == MAP:
+        if len(body) < MAP_BODY.size:
+            raise ProtocolError("Bad map message.")
+        width, height, version, message["hash"] = MAP_BODY.unpack_from(body)
+        cells = body[MAP_BODY.size:]
+        if len(cells) != width * height:
+            raise ProtocolError("Map message has the wrong number of cells.")
+        cells = np.frombuffer(cells, dtype=np.int8).reshape(height, width)
+        message["map"] = GridMap(width, height, cells.copy(), version)
+    elif message_type == MAP_DELTA:
+        if len(body) < MAP_DELTA_BODY.size:
+            raise ProtocolError("Bad map delta message.")
+        (message["base version"], message["version"], message["hash"],
+         count) = MAP_DELTA_BODY.unpack_from(body)
+        if len(body) != MAP_DELTA_BODY.size + count*5:
+            raise ProtocolError("Map delta message has the wrong length.")
+        start = MAP_DELTA_BODY.size
+        message["indexes"] = np.frombuffer(body, dtype=">u4", count=count,
+                                           offset=start).astype(np.intp)
+        message["values"] = np.frombuffer(body, dtype=np.int8, count=count,
+                                          offset=start + count*4)
+    elif message_type == PING:
+        if len(body) != PING_BODY.size:
+            raise ProtocolError("Bad ping message.")
+        message["time"], = PING_BODY.unpack(body)
+    elif message_type == PONG:
+        if len(body) != PONG_BODY.size:
+            raise ProtocolError("Bad pong message.")
+        message["to"], message["time"] = PONG_BODY.unpack(body)
+    elif message_type == SNAPSHOT:
+        if len(body) < SNAPSHOT_BODY.size:
+            raise ProtocolError("Bad snapshot message.")
+        count, = SNAPSHOT_BODY.unpack_from(body)
+        if len(body) != SNAPSHOT_BODY.size + count*SNAPSHOT_ENTRY_SIZE:
+            raise ProtocolError("Snapshot message has the wrong length.")
+        # Every player in the snapshot is decoded as if they had sent their
+        # own position message.
+        message["players"] = []
+        for i in range(count):
+            start = SNAPSHOT_BODY.size + i*SNAPSHOT_ENTRY_SIZE
+            entry = body[start:start + SNAPSHOT_ENTRY_SIZE]
+            message["players"].append(decode(
+                bytes([POSITION]) + bytes(entry)))
+    elif message_type != MAP_REQUEST:
+        raise ProtocolError(f"Unknown message type {message_type}.")
+
+    return message
+
+
+def frame(payload):
+    """Return a payload with its length prefixed so it can be sent."""
+    return LENGTH.pack(len(payload)) + payload
+
+
+def recv_exactly(sock, n):
+    """
+    Receive exactly n bytes from a socket, or return None if the connection
+    is closed first.
+    """
+    chunks = []
+    remaining = n
+    # While there are still bytes to receive.
+    while remaining:
+        # Get remaining bytes or 4096 bytes (whatever is smaller).
+        chunk = sock.recv(min(remaining, 4096))
+        if not chunk:
+            return None
+        remaining -= len(chunk)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def read_frame(sock):
+    """
+    Return the payload of the next frame received from a socket, or None if
+    the connection has been closed.
+    """
+    # Find how big the message to be received is in bytes.
+    length = recv_exactly(sock, LENGTH.size)
+    if length is None:
+        return None
+    return recv_exactly(sock, LENGTH.unpack(length)[0])
@@ -0,0 +1,27 @@
+"""
+Camera projection tables that only depend on the size of the screen.
+"""
+from render.raycaster import camera_x_table
+
+
+class Camera:
+    def __init__(self):
+        # Size of the surface the tables were made for.
+        self.size = None
+        self.w = 0
+        self.h = 0
+        # Camera plane x coord of every x pixel of the screen.
+        self.camera_x = None
+
+    def resize(self, size):
+        """
+        Rebuild the tables if the surface size has changed since they were
+        last made, e.g. because the display has been resized.
+        """
+        if size == self.size:
+            return
+        self.size = size
+        self.w, self.h = size
+        self.camera_x = camera_x_table(self.w)
+        # The tables are read-only so they can be shared by worker threads.
+        self.camera_x.flags.writeable = False
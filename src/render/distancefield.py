@@ -0,0 +1,88 @@
+"""
+Chebyshev distance field over a map used to skip across empty space.
+
+Every cell holds the Chebyshev distance (the number of king moves) from that
+cell to the closest wall, capped at a limit. A ray in a cell with distance d
+can't hit anything before it has moved d cells in x or in y, so the raycaster
+can take all of those DDA steps at once without looking at the map.
+"""
+import numpy as np
+
+# Largest distance stored. Larger limits allow longer jumps but make each
+# jump and each incremental update more expensive.
+MAX_DISTANCE = 32
+# Most cells changed at once that are updated one at a time. Past this it's
+# quicker to rebuild the whole field.
+MAX_UPDATED_CELLS = 64
+
+
+def _distance_field(solid, limit):
+    """
+    Return the Chebyshev distance from every cell of a bool array to the
+    closest True cell, capped at limit. Cells outside the array count as True.
+    """
+    dist = np.zeros(solid.shape, dtype=np.uint8)
+    empty = ~solid
+    for d in range(1, limit + 1):
+        # Cells still empty after d-1 erosions have no wall within d-1 cells.
+        dist[empty] = d
+        # Erode the empty cells by a 3x3 square: a cell stays empty only if
+        # all 8 of its neighbours are empty. Done as a row then column pass.
+        eroded = empty.copy()
+        eroded[1:] &= empty[:-1]
+        eroded[:-1] &= empty[1:]
+        eroded[0] = eroded[-1] = False
+        empty = eroded.copy()
+        empty[:, 1:] &= eroded[:, :-1]
+        empty[:, :-1] &= eroded[:, 1:]
+        empty[:, 0] = empty[:, -1] = False
+        if not empty.any():
+            break
+    return dist
+
+
+class DistanceField:
+    def __init__(self, map, limit=MAX_DISTANCE):
+        """Build the distance field of a GridMap."""
+        self.map = map
+        self.limit = limit
+        self.dist = _distance_field(map.cells >= 1, limit)
+
+    def copy(self, map=None):
+        """
+        Return a copy of the field, optionally for a copy of its map that has
+        the same cells.
+        """
+        field = DistanceField.__new__(DistanceField)
+        field.map = self.map if map is None else map
+        field.limit = self.limit
+        field.dist = self.dist.copy()
+        return field
+
+    def update(self, row, col):
+        """Rebuild the part of the field affected by a change to one cell."""
+        # Capped distances only depend on cells up to limit cells away, so the
+        # cells up to limit away from the changed cell are recalculated from
+        # a window twice that size.
+        k = self.limit
+        r0, r1 = max(row - 2*k, 0), min(row + 2*k + 1, self.map.height)
+        c0, c1 = max(col - 2*k, 0), min(col + 2*k + 1, self.map.width)
+        window = _distance_field(self.map.cells[r0:r1, c0:c1] >= 1, k)
+
+        # Window edges that are inside the map aren't really walls, so only
+        # keep the middle of the window, which is far enough from its edges.
+        i0, i1 = max(row - k, 0), min(row + k + 1, self.map.height)
+        j0, j1 = max(col - k, 0), min(col + k + 1, self.map.width)
+        self.dist[i0:i1, j0:j1] = window[i0 - r0:i1 - r0, j0 - c0:j1 - c0]
+
+    def update_cells(self, indexes):
+        """
+        Rebuild the parts of the field affected by changes to the cells at
+        flat indexes (row*width + col), or the whole field if so many cells
+        changed that it's quicker to start again.
+        """
+        if len(indexes) > MAX_UPDATED_CELLS:
+            self.dist = _distance_field(self.map.cells >= 1, self.limit)
+            return
+        for index in indexes:
+            self.update(*divmod(int(index), self.map.width))
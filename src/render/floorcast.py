@@ -0,0 +1,110 @@
+"""
+Floor and ceiling casting. Every pixel below the horizon is the floor at a
+distance that only depends on its row, so the world coords of the whole
+floor are an outer product of one row distance per row and one ray direction
+per column. The ceiling is the floor mirrored about the horizon.
+"""
+import numpy as np
+
+from render.textures import TEXTURE_SIZE, MappedTextures, stone_texture
+from vector import VectorArray
+
+
+def checker_texture(colour, other, size=TEXTURE_SIZE, squares=2):
+    """
+    Return a size x size RGB texture indexed [x][y] of a checker pattern of
+    two colours with squares x squares squares.
+    """
+    x, y = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    square = size // squares
+    texture = np.empty((size, size, 3), dtype=np.uint8)
+    texture[:] = colour
+    texture[(x // square + y // square) % 2 == 1] = other
+    return texture
+
+
+def _texture_coords(origin, ray, row_distance, size):
+    """
+    Return the texture coord along one axis of the floor seen by every
+    column's ray component in every row, [column][row]. Worked out in float32
+    and int32 as it halves the memory the screen sized arrays go through.
+    """
+    coord = np.multiply.outer(ray.astype(np.float32), row_distance)
+    coord += np.float32(origin)
+    coord *= np.float32(size)
+    tex = np.floor(coord, out=coord).astype(np.int32)
+    tex &= size - 1
+    return tex
+
+
+class FloorCaster:
+    """Draws a textured floor and ceiling into a Rasterizer's frame buffer."""
+    def __init__(self, floor=None, ceiling=None):
+        # RGB textures of the floor and ceiling, the same size as each other.
+        self.floor = (checker_texture((90, 90, 90), (60, 60, 60))
+                      if floor is None else floor)
+        self.ceiling = (stone_texture((50, 40, 35), seed=2)
+                        if ceiling is None else ceiling)
+        self.size = len(self.floor)
+        # Textures mapped to the pixel format of the surface drawn to, as
+        # flat arrays indexed by tex_x*size + tex_y.
+        self.mapped_textures = MappedTextures([self.floor, self.ceiling])
+        self.mapped_floor = None
+        self.mapped_ceiling = None
+        # Distance to the floor seen in each row of the bottom half of the
+        # screen, rebuilt only when the screen height changes.
+        self.h = None
+        self.row_distance = None
+
+    def map_textures(self, surface):
+        """Map the textures to the pixel format of a surface if it changed."""
+        if self.mapped_textures.map(surface):
+            self.mapped_floor, self.mapped_ceiling = (
+                texture.astype(np.uint32).ravel()
+                for texture in self.mapped_textures.mapped)
+
+    def row_distances(self, h):
+        """
+        Return the distance from the camera plane of the floor seen in each
+        row of the bottom half of a screen h pixels high.
+        """
+        if h != self.h:
+            self.h = h
+            # The camera is half a wall high, which is h/2 pixels at a
+            # distance of 1. Rows are measured from their centres so the
+            # first row below the horizon is never a zero division.
+            rows = np.arange(h - h // 2, h) + 0.5 - h / 2
+            self.row_distance = (0.5 * h / rows).astype(np.float32)
+        return self.row_distance
+
+    def draw(self, rasterizer, pos, dir, plane, camera_x, h,
+             perp_wall_dist=None):
+        """
+        Fill the top and bottom halves of the frame buffer. If the distance
+        to the wall of every column is given the rows next to the horizon
+        that the walls cover in every column are skipped.
+        """
+        self.map_textures(rasterizer.surface)
+        frame = rasterizer.frame
+        row_distance = self.row_distances(h)
+        if perp_wall_dist is not None:
+            # Half the height of the furthest wall, less one row in case of
+            # rounding.
+            covered = int(h / np.max(perp_wall_dist)) // 2 - 1
+            row_distance = row_distance[max(covered, 0):]
+        ray_dir = VectorArray.along(dir, plane, camera_x)
+        size = self.size
+
+        # Flat texture index of every floor pixel, [column][row].
+        index = _texture_coords(pos.x, ray_dir.x, row_distance, size)
+        index *= size
+        index += _texture_coords(pos.y, ray_dir.y, row_distance, size)
+
+        rows = len(row_distance)
+        # Looked up straight into the frame buffer without a temporary copy.
+        # Every index is already in range so it isn't checked.
+        np.take(self.mapped_floor, index, out=frame[:, h - rows:], mode="wrap")
+        # The ceiling row the same distance above the horizon looks at the
+        # same spot, so its rows are the floor's in reverse.
+        np.take(self.mapped_ceiling, index, out=frame[:, :rows][:, ::-1],
+                mode="wrap")
@@ -0,0 +1,105 @@
+"""
+Parallel raycasting that splits the screen into bands of columns and casts
+each band on a worker of a thread or process pool.
+
+Every ray is independent so joining the bands back together gives exactly the
+same result as casting the whole screen at once with cast_rays.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from render.raycaster import RayHits, cast_rays
+
+# Maps attached to by a worker process, keyed by shared memory block name.
+_worker_maps = {}
+
+
+def _cast_shared_band(name, shape, dtype, pos, dir, plane, camera_x):
+    """Cast a band of rays in a worker process against a shared memory map."""
+    if name not in _worker_maps:
+        # Only the newest map is kept attached.
+        for shm, _ in _worker_maps.values():
+            shm.close()
+        _worker_maps.clear()
+        shm = shared_memory.SharedMemory(name=name)
+        _worker_maps[name] = (shm, np.ndarray(shape, dtype, buffer=shm.buf))
+    return cast_rays(_worker_maps[name][1], pos, dir, plane, camera_x)
+
+
+class ParallelCaster:
+    def __init__(self, workers=None, processes=False):
+        # Number of bands the screen is split into, one per worker.
+        self.workers = workers or os.cpu_count() or 1
+        self.processes = processes
+        if processes:
+            self.pool = ProcessPoolExecutor(self.workers)
+        else:
+            self.pool = ThreadPoolExecutor(self.workers)
+
+        # The map the workers read from and what it was made from, so it's
+        # only converted (and copied to shared memory) when the map changes.
+        self.map_source = None
+        self.map_version = None
+        self.grid = None
+        self.shm = None
+
+    def share_map(self, world_map):
+        """Make the map readable by every worker without copying it per band."""
+        version = getattr(world_map, "version", None)
+        if world_map is self.map_source and version == self.map_version:
+            return
+        self.map_source = world_map
+        self.map_version = version
+        grid = np.asarray(world_map)
+
+        if self.processes:
+            self.release_map()
+            self.shm = shared_memory.SharedMemory(create=True,
+                                                  size=max(grid.nbytes, 1))
+            self.grid = np.ndarray(grid.shape, grid.dtype, buffer=self.shm.buf)
+            self.grid[:] = grid
+        else:
+            # Threads share memory already so they all read the same array,
+            # through a view so only the workers' access is read only and
+            # the map itself can still be changed.
+            self.grid = grid.view()
+        self.grid.flags.writeable = False
+
+    def release_map(self):
+        """Free the shared memory block holding the map, if there is one."""
+        if self.shm is not None:
+            self.grid = None
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def cast(self, world_map, pos, dir, plane, camera_x, field=None):
+        """
+        Cast every ray in camera_x split into one band per worker and return
+        the joined RayHits. Thread workers skip across empty space with the
+        DistanceField field if one is given, process workers don't use it as
+        that would mean sending it to every process each frame.
+        """
+        self.share_map(world_map)
+        bands = np.array_split(camera_x, self.workers)
+
+        if self.processes:
+            futures = [self.pool.submit(_cast_shared_band, self.shm.name,
+                                        self.grid.shape, self.grid.dtype,
+                                        pos, dir, plane, band)
+                       for band in bands if band.size]
+        else:
+            futures = [self.pool.submit(cast_rays, self.grid, pos, dir, plane,
+                                        band, field)
+                       for band in bands if band.size]
+
+        results = [future.result() for future in futures]
+        return RayHits(*(np.concatenate(values) for values in zip(*results)))
+
+    def close(self):
+        """Shut down the worker pool and free the shared map."""
+        self.pool.shutdown()
+        self.release_map()
@@ -0,0 +1,93 @@
+"""
+Column span rasterizer that draws vertical spans for many screen columns in a
+few bulk array writes instead of one pygame.draw.line call per column.
+"""
+import numpy as np
+import pygame
+
+
+def wall_spans(h, perp_wall_dist):
+    """
+    Return the drawStart and drawEnd pixel rows of the wall stripe of every
+    column for a screen h pixels high.
+    """
+    lineHeight = np.trunc(h / np.asarray(perp_wall_dist)).astype(np.intp)
+
+    # if above top of screen
+    drawStart = np.maximum(-lineHeight / 2 + h / 2, 0)
+    # if below bottom of screen
+    drawEnd = np.minimum(lineHeight / 2 + h / 2, h - 1)
+
+    # pygame.draw.line truncates its float coordinates so do the same here.
+    return drawStart.astype(np.intp), drawEnd.astype(np.intp)
+
+
+class Rasterizer:
+    def __init__(self):
+        # Frame buffer indexed [x][y] like pygame.surfarray, reallocated only
+        # when the size of the surface being drawn to changes.
+        self.surface = None
+        self.size = None
+        self.frame = None
+        self.rows = None
+
+    def begin(self, surface, background):
+        """Start a new frame by filling the frame buffer with a colour."""
+        size = surface.get_size()
+        if size != self.size:
+            self.size = size
+            self.frame = np.empty(size, dtype=np.uint32)
+            # Row number of every pixel in a column, compared against span
+            # start and end rows to build a mask of the pixels in each span.
+            self.rows = np.arange(size[1])
+        self.surface = surface
+        self.frame.fill(surface.map_rgb(background))
+
+    def reuse(self, surface):
+        """
+        Start a new frame by keeping the last frame buffer as it is. Returns
+        False, and does nothing, if there's no frame buffer for a surface of
+        this size to reuse.
+        """
+        if self.frame is None or surface.get_size() != self.size:
+            return False
+        self.surface = surface
+        return True
+
+    def spans(self, drawStart, drawEnd, colour, x_start=0, visible=None):
+        """
+        Fill the span between drawStart and drawEnd (inclusive) of every column
+        from x_start onwards with a colour. visible optionally masks out columns
+        that shouldn't be drawn, e.g. sprite stripes hidden behind walls.
+        """
+        drawStart = np.asarray(drawStart)
+        drawEnd = np.asarray(drawEnd)
+        columns = self.frame[x_start:x_start + len(drawStart)]
+
+        mask = ((self.rows >= drawStart[:, np.newaxis])
+                & (self.rows <= drawEnd[:, np.newaxis]))
+        if visible is not None:
+            mask &= np.asarray(visible)[:, np.newaxis]
+
+        columns[mask] = self.surface.map_rgb(colour)
+
+    def map_colours(self, colours):
+        """Return an array of the pixel values of a sequence of colours."""
+        return np.array([self.surface.map_rgb(colour) for colour in colours],
+                        dtype=np.uint32)
+
+    def column_spans(self, x, drawStart, drawEnd, pixels):
+        """
+        Fill the span between drawStart and drawEnd (inclusive) of each of the
+        columns in the array x with that column's pixel value from
+        map_colours(), for spans like sprite stripes which don't cover a
+        continuous run of columns.
+        """
+        mask = ((self.rows >= np.asarray(drawStart)[:, np.newaxis])
+                & (self.rows <= np.asarray(drawEnd)[:, np.newaxis]))
+        self.frame[x] = np.where(mask, np.asarray(pixels)[:, np.newaxis],
+                                 self.frame[x])
+
+    def end(self):
+        """Copy the finished frame buffer onto the surface in one blit."""
+        pygame.surfarray.blit_array(self.surface, self.frame)
@@ -0,0 +1,185 @@
+"""
+Batched raycasting engine that casts every screen column at once with NumPy.
+
+It follows exactly the same steps as the scalar loop in Gameplay but works on
+arrays holding one element per column, so the results are identical.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from maps.chunkedmap import ChunkedMap
+from vector import VectorArray
+
+# perp_wall_dist - distance from the camera plane to the wall hit by each ray
+# side           - 0 if an X side of a wall was hit, 1 if a Y side was hit
+# map_x, map_y   - map cell hit by each ray
+# steps          - number of DDA steps each ray took before hitting a wall
+RayHits = namedtuple("RayHits", ["perp_wall_dist", "side", "map_x", "map_y",
+                                 "steps"])
+
+
+def camera_x_table(w):
+    """Return the camera plane x coord of every x pixel of a screen w wide."""
+    # Convert the x coord of the screen to x coord of the camera plane
+    # So instead of  0 --> 360 --> 720
+    # it is         -1 --> 0 --> 1
+    # + 0.001 to stop zero division error.
+    return (2*np.arange(w) / w) - 1 + 0.001
+
+
+def _skip_empty_space(rays, dist, map_x, map_y, side_x, side_y, delta_x,
+                      delta_y, step_x, step_y, steps):
+    """
+    Move rays that are far from any wall straight to the last cell the DDA
+    would reach before it could possibly hit a wall. dist is the distance
+    field value of the cell each ray is in.
+
+    Every cell up to radius = distance - 1 cells away in x and y from the
+    cell a ray is in is empty, so the ray can take up to radius x steps and
+    radius y steps without a map lookup. The side distances of those steps
+    are made with cumsum, which adds in the same order as the DDA loop, so
+    rays end up in exactly the same state as if they had stepped one at a
+    time.
+    """
+    radius = dist.astype(np.intp) - 1
+    # Short jumps cost more than the steps they save.
+    far = (radius >= 4) & ~np.isnan(side_x[rays]) & ~np.isnan(side_y[rays])
+    rays = rays[far]
+    if not rays.size:
+        return
+    radius = radius[far]
+    n = np.arange(rays.size)
+    cols = np.arange(radius.max() + 1)
+
+    # Side distance after 0, 1, 2 ... steps in x and in y.
+    sx = np.cumsum(np.column_stack(
+        [side_x[rays], np.repeat(delta_x[rays][:, np.newaxis], cols.size - 1,
+                                 axis=1)]), axis=1)
+    sy = np.cumsum(np.column_stack(
+        [side_y[rays], np.repeat(delta_y[rays][:, np.newaxis], cols.size - 1,
+                                 axis=1)]), axis=1)
+    in_radius = cols <= radius[:, np.newaxis]
+    sx_last = sx[n, radius]
+    sy_last = sy[n, radius]
+
+    # The DDA merges the two sequences of side distances, stepping in x while
+    # the x side distance is smaller. Stop just before whichever of the
+    # (radius + 1)th x step or y step comes first.
+    x_first = sx_last < sy_last
+    x_steps = np.where(x_first, radius,
+                       np.sum((sx < sy_last[:, np.newaxis]) & in_radius, axis=1))
+    y_steps = np.where(x_first,
+                       np.sum((sy <= sx_last[:, np.newaxis]) & in_radius, axis=1),
+                       radius)
+
+    map_x[rays] += step_x[rays] * x_steps
+    map_y[rays] += step_y[rays] * y_steps
+    side_x[rays] = sx[n, x_steps]
+    side_y[rays] = sy[n, y_steps]
+    steps[rays] += x_steps + y_steps
+
+
+def cast_rays(world_map, pos, dir, plane, camera_x, field=None):
+    """
+    Cast one ray for every camera plane x coord in camera_x and return a
+    RayHits of arrays holding the result of every ray. If a DistanceField of
+    the map is given it is used to skip across empty space, which gives the
+    same result in fewer iterations on open maps.
+    """
+    # Chunked maps aren't one array so their cells are looked up through
+    # their tile cache, which takes the same map[rows, cols] indexing.
+    if isinstance(world_map, ChunkedMap):
+        grid = world_map
+    else:
+        grid = np.asarray(world_map)
+    rows, cols = grid.shape
+    n = len(camera_x)
+
+    # Find the direction of every ray using vector maths.
+    rays = VectorArray.along(dir, plane, camera_x)
+    ray_x = rays.x
+    ray_y = rays.y
+
+    # Convert player pos (float) to map pos (int) for every ray.
+    map_x = np.full(n, int(pos.x), dtype=np.intp)
+    map_y = np.full(n, int(pos.y), dtype=np.intp)
+
+    with np.errstate(divide="ignore"):
+        delta_x = np.abs(1 / ray_x)
+        delta_y = np.abs(1 / ray_y)
+
+    # Step to the left/ down if the ray is pointing left/ down otherwise step
+    # to the right/ up.
+    left = ray_x < 0
+    down = ray_y < 0
+    step_x = np.where(left, -1, 1)
+    step_y = np.where(down, -1, 1)
+
+    # Straight line distance from player to the first x-side and y-side.
+    with np.errstate(invalid="ignore"):
+        side_x = np.where(left, (pos.x - map_x) * delta_x,
+                          (map_x + 1 - pos.x) * delta_x)
+        side_y = np.where(down, (pos.y - map_y) * delta_y,
+                          (map_y + 1 - pos.y) * delta_y)
+
+    side = np.zeros(n, dtype=np.int8)
+    steps = np.zeros(n, dtype=np.intp)
+
+    # Indexes of the rays that haven't hit a wall yet.
+    active = np.arange(n)
+    while active.size:
+        # Modified DDA algorithm applied to every active ray at once.
+        # Rays that have moved less in the X direction move in the X direction
+        # and the rest move in the Y direction.
+        x_rays = side_x[active] < side_y[active]
+        ax = active[x_rays]
+        ay = active[~x_rays]
+
+        side_x[ax] += delta_x[ax]
+        map_x[ax] += step_x[ax]
+        side[ax] = 0    # X side hit
+
+        side_y[ay] += delta_y[ay]
+        map_y[ay] += step_y[ay]
+        side[ay] = 1    # Y side hit
+
+        steps[active] += 1
+
+        # A ray has hit if where it is isn't empty. Rays that leave the map
+        # are treated as hitting a wall so maps without a border can't hang.
+        mx = map_x[active]
+        my = map_y[active]
+        inside = (mx >= 0) & (mx < rows) & (my >= 0) & (my < cols)
+        hit = ~inside
+        if field is None:
+            hit[inside] = grid[mx[inside], my[inside]] >= 1
+            active = active[~hit]
+        else:
+            # Walls are the cells with a distance of 0 so the field replaces
+            # the map lookup.
+            dist = np.zeros(active.size, dtype=np.uint8)
+            dist[inside] = field.dist[mx[inside], my[inside]]
+            hit |= dist == 0
+            active = active[~hit]
+            if active.size:
+                _skip_empty_space(active, dist[~hit], map_x, map_y, side_x,
+                                  side_y, delta_x, delta_y, step_x, step_y,
+                                  steps)
+
+    # Find the x or y component of the distance from the player to the wall.
+    # If the ray stepped to the left/ down then correct the distance by +1
+    # due to how int() always rounds down when finding map pos.
+    x_component = map_x - pos.x
+    x_component = np.where(step_x == -1, x_component + 1, x_component)
+    y_component = map_y - pos.y
+    y_component = np.where(step_y == -1, y_component + 1, y_component)
+
+    # Components are / ray direction due to similar triangles and
+    # simultaneous equations that solve for perpWallDist.
+    with np.errstate(divide="ignore", invalid="ignore"):
+        perp_wall_dist = np.where(side == 0, x_component / ray_x,
+                                  y_component / ray_y)
+    perp_wall_dist += 0.001     # stop zero division error
+
+    return RayHits(perp_wall_dist, side, map_x, map_y, steps)
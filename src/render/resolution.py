@@ -0,0 +1,86 @@
+"""
+Dynamic resolution scaling. The cost of a frame grows with the number of
+screen columns rays are cast for, so casting fewer columns and stretching
+the frame to the screen keeps the frame time near a target when the scene is
+expensive to draw.
+"""
+from collections import deque
+
+import numpy as np
+
+
+def scaled_width(w, scale, step=8):
+    """
+    Return the number of columns to draw for a screen w pixels wide at a
+    scale, rounded to a multiple of step so the buffers sized by it aren't
+    remade for every small change of scale.
+    """
+    if scale >= 1:
+        return w
+    return min(max(round(w * scale / step) * step, step), w)
+
+
+class ResolutionController:
+    """
+    Picks the fraction of the screen's columns to draw at each frame from
+    how long the frames before it took to draw.
+    """
+    def __init__(self, min_scale=0.25, max_scale=1.0, history=120,
+                 smoothing=0.1, max_step=0.1, dead_band=0.05):
+        # Fraction of the screen's columns to draw, kept between min_scale
+        # and max_scale.
+        self.scale = max_scale
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        # How much of each new frame time goes into the moving average.
+        self.smoothing = smoothing
+        # Most the scale can change by in one frame, as a fraction of itself.
+        self.max_step = max_step
+        # Frame times this close to the target, as a fraction of it, don't
+        # change the scale so it doesn't flicker between two sizes.
+        self.dead_band = dead_band
+        # Draw times of the most recent frames in milliseconds.
+        self.frame_times = deque(maxlen=history)
+        # Exponential moving average of the draw time in milliseconds.
+        self.average = None
+
+    def update(self, frame_ms, target_ms=None):
+        """
+        Record how long the last frame took to draw and return the scale to
+        draw the next one at to get closer to target_ms. If target_ms is None
+        the frame is only recorded and the scale is left alone.
+        """
+        self.frame_times.append(frame_ms)
+        if self.average is None:
+            self.average = frame_ms
+        else:
+            self.average += self.smoothing * (frame_ms - self.average)
+        if target_ms is None:
+            return self.scale
+
+        # Draw time is roughly proportional to the number of columns drawn,
+        # so scaling them by target / average would hit the target.
+        ratio = target_ms / max(self.average, 1e-6)
+        if abs(ratio - 1) > self.dead_band:
+            ratio = min(max(ratio, 1 - self.max_step), 1 + self.max_step)
+            scale = min(max(self.scale * ratio, self.min_scale),
+                        self.max_scale)
+            # Expect the change to show up in the average straight away, so
+            # the old slower or faster frames in it don't push the scale too
+            # far before it catches up.
+            self.average *= scale / self.scale
+            self.scale = scale
+        return self.scale
+
+    def stats(self):
+        """
+        Return a dict of the current scale and the mean, p50 and p95 draw
+        times in milliseconds of the recent frames.
+        """
+        times = np.array(self.frame_times)
+        if not len(times):
+            return {"scale": self.scale, "mean": None, "p50": None,
+                    "p95": None}
+        return {"scale": self.scale, "mean": float(times.mean()),
+                "p50": float(np.percentile(times, 50)),
+                "p95": float(np.percentile(times, 95))}
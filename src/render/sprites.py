@@ -0,0 +1,88 @@
+"""
+Batched sprite renderer that projects any number of sprites at once and hides
+the parts of them behind walls with array operations against the ZBuffer.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from vector import VectorArray
+
+# Screen column of every visible sprite stripe with the rows it's drawn
+# between and the index of the sprite it belongs to.
+SpriteStripes = namedtuple("SpriteStripes",
+                           ["x", "drawStart", "drawEnd", "sprite"])
+
+
+def sprite_stripes(sprites, pos, dir, plane, ZBuffer, h):
+    """
+    Return the SpriteStripes to draw for a VectorArray of sprite positions
+    seen by a camera at pos, with one stripe per screen column at most.
+
+    Sprites behind the camera or off the screen are culled and the rest are
+    sorted back to front. As every sprite is centred on the horizon a nearer
+    sprite's stripe covers the whole stripe of a further one in the same
+    column, so only the nearest visible stripe of each column is kept.
+    """
+    ZBuffer = np.asarray(ZBuffer)
+    w = len(ZBuffer)
+
+    # WORLD SPACE
+    # Find relative position of the sprites, nudged off zero to stop zero
+    # division errors.
+    relative = VectorArray(sprites.x - pos.x, sprites.y - pos.y)
+    relative.x[relative.x == 0] += 0.001
+    relative.y[relative.y == 0] += 0.001
+
+    # CAMERA SPACE
+    # Inverse the camera matrix to get a view matrix
+    invDet = 1 / (plane.x*dir.y - dir.x*plane.y)
+
+    # X coord - in camera space
+    transformX = invDet * (dir.y*relative.x - dir.x*relative.y)
+    # Y coord - in camera space, the depth of the sprite
+    transformY = invDet * (-plane.y*relative.x + plane.x*relative.y)
+
+    # Cull sprites behind the camera then sort the rest back to front.
+    index = np.flatnonzero(transformY > 0)
+    index = index[np.argsort(-transformY[index], kind="stable")]
+    transformX = transformX[index]
+    transformY = transformY[index]
+
+    # SCREEN SPACE (pixels)
+    # Translate and scale the camera plane coords -1 -> 0 --> 1 to pixel
+    # coords 0 --> w/2 --> w, truncating like int() does.
+    spriteScreenX = np.trunc((w / 2) * (1 + transformX / transformY))
+    spriteSize = np.trunc(h / transformY)
+
+    # Start and end draw points of each sprite from its centre, clipped to
+    # the screen.
+    drawStartX = np.trunc(np.maximum(-spriteSize / 2 + spriteScreenX, 0))
+    drawEndX = np.trunc(np.minimum(spriteSize / 2 + spriteScreenX, w - 1))
+    drawStartY = np.trunc(np.maximum(-spriteSize / 2 + h / 2, 0))
+    drawEndY = np.trunc(np.minimum(spriteSize / 2 + h / 2, h - 1))
+    stripes = np.maximum(drawEndX - drawStartX, 0).astype(np.intp)
+
+    # One entry per stripe of every sprite on screen, back to front. Sprites
+    # entirely off the screen have no stripes.
+    sprite = np.repeat(np.arange(len(index)), stripes)
+    offsets = np.arange(len(sprite)) - np.repeat(np.cumsum(stripes) - stripes,
+                                                 stripes)
+    x = drawStartX.astype(np.intp)[sprite] + offsets
+
+    # A stripe is visible if the sprite is closer than the wall in its column.
+    visible = transformY[sprite] < ZBuffer[x]
+    sprite = sprite[visible]
+    x = x[visible]
+
+    # Keep the last, so nearest, stripe of each column.
+    order = np.argsort(x, kind="stable")
+    x = x[order]
+    sprite = sprite[order]
+    last = np.ones(len(x), dtype=bool)
+    last[:-1] = x[1:] != x[:-1]
+    x = x[last]
+    sprite = sprite[last]
+
+    return SpriteStripes(x, drawStartY[sprite].astype(np.intp),
+                         drawEndY[sprite].astype(np.intp), index[sprite])
@@ -0,0 +1,220 @@
+"""
+Textured walls drawn from a cache of texture columns already scaled to the
+height they're drawn at, so most columns of a frame are copied straight into
+the frame buffer instead of being sampled pixel by pixel.
+"""
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+from vector import VectorArray
+
+# Width and height of every texture in pixels. A power of 2 so texture
+# coords wrap with a bitwise and.
+TEXTURE_SIZE = 64
+
+
+def brick_texture(colour, mortar, size=TEXTURE_SIZE, rows=4, columns=2):
+    """
+    Return a size x size RGB texture indexed [x][y] like pygame.surfarray of
+    bricks of one colour separated by mortar. Every other row of bricks is
+    offset by half a brick.
+    """
+    x, y = np.meshgrid(np.arange(size), np.arange(size), indexing="ij")
+    brick_height = size // rows
+    brick_width = size // columns
+    row = y // brick_height
+    shifted_x = x + (row % 2) * (brick_width // 2)
+    is_mortar = ((y % brick_height == 0) | (shifted_x % brick_width == 0))
+
+    texture = np.empty((size, size, 3), dtype=np.uint8)
+    texture[:] = colour
+    texture[is_mortar] = mortar
+    return texture
+
+
+def stone_texture(colour, size=TEXTURE_SIZE, seed=0):
+    """Return a size x size RGB texture of noisy stone of one colour."""
+    noise = np.random.default_rng(seed).uniform(0.75, 1.0, (size, size, 1))
+    return (np.asarray(colour, dtype=float) * noise).astype(np.uint8)
+
+
+def default_textures(size=TEXTURE_SIZE):
+    """Return the list of textures used for walls 1, 2, 3 etc. in order."""
+    return [brick_texture((170, 30, 30), (200, 200, 200), size),
+            stone_texture((160, 160, 160), size),
+            brick_texture((60, 90, 170), (40, 40, 40), size, rows=8, columns=4),
+            stone_texture((140, 100, 60), size, seed=1)]
+
+
+def texture_x(hits, pos, dir, plane, camera_x, size=TEXTURE_SIZE):
+    """Return the x coord of the texture column each ray of RayHits hit."""
+    ray_dir = VectorArray.along(dir, plane, camera_x)
+    perp_wall_dist = np.asarray(hits.perp_wall_dist)
+    side = np.asarray(hits.side)
+
+    # Where exactly the wall was hit, as a fraction of the cell's side.
+    wall_x = np.where(side == 0, pos.y + perp_wall_dist*ray_dir.y,
+                      pos.x + perp_wall_dist*ray_dir.x)
+    wall_x -= np.floor(wall_x)
+
+    tex_x = (wall_x * size).astype(np.intp)
+    # Flip the texture on the sides facing the other way so it isn't
+    # mirrored.
+    flip = (((side == 0) & (ray_dir.x > 0))
+            | ((side == 1) & (ray_dir.y < 0)))
+    tex_x[flip] = size - tex_x[flip] - 1
+    return tex_x
+
+
+class MappedTextures:
+    """
+    RGB textures mapped to the pixel format of the surface they're drawn to,
+    so their pixels can be copied straight into a frame buffer. They're only
+    mapped again when the pixel format changes.
+    """
+    def __init__(self, textures):
+        self.textures = textures
+        self.format = None
+        # Mapped texture of each texture, indexed [x][y].
+        self.mapped = None
+
+    def map(self, surface):
+        """
+        Map the textures to the pixel format of a surface if it changed and
+        return True if they were mapped.
+        """
+        format = (surface.get_bitsize(), surface.get_masks())
+        if format == self.format:
+            return False
+        self.format = format
+        self.mapped = [pygame.surfarray.map_array(surface, texture)
+                       for texture in self.textures]
+        return True
+
+
+class ColumnCache:
+    """
+    Least recently used cache of texture columns scaled to a line height,
+    keyed by (texture, texture x, line height, screen height). The oldest
+    columns are evicted once the columns held take up more than max_bytes.
+    """
+    def __init__(self, max_bytes=16 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.columns = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return a cached column, or None if it isn't cached."""
+        column = self.columns.get(key)
+        if column is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.columns.move_to_end(key)
+        return column
+
+    def put(self, key, column):
+        """Cache a column, evicting the least recently used if needed."""
+        self.columns[key] = column
+        self.bytes += column.nbytes
+        while self.bytes > self.max_bytes and self.columns:
+            _, evicted = self.columns.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def clear(self):
+        """Empty the cache, keeping the counters."""
+        self.columns.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """
+        Return a dict of the hits, misses, hit rate, evictions, number of
+        columns held and bytes used so the cache size can be tuned.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions, "columns": len(self.columns),
+                "bytes": self.bytes}
+
+
+class WallTextures:
+    """Draws walls with a texture per wall value through a ColumnCache."""
+    def __init__(self, textures=None, max_bytes=16 * 1024 * 1024,
+                 height_step=1):
+        # RGB textures of walls 1, 2, 3 etc. Wall values past the end of the
+        # list wrap around.
+        self.textures = default_textures() if textures is None else textures
+        self.size = len(self.textures[0])
+        # Line heights are rounded down to a multiple of height_step so more
+        # columns share a cache entry. 1 draws every wall at its exact height.
+        self.height_step = height_step
+        self.cache = ColumnCache(max_bytes)
+        # Textures mapped to the pixel format of the surface drawn to, with
+        # a darker copy of each for Y sides of walls. The cache is cleared
+        # whenever they're mapped again.
+        self.mapped_textures = MappedTextures(
+            [shade for texture in self.textures
+             for shade in (texture, texture // 2)])
+        self.mapped = None
+
+    def map_textures(self, surface):
+        """Map the textures to the pixel format of a surface if it changed."""
+        if self.mapped_textures.map(surface):
+            self.mapped = self.mapped_textures.mapped
+            self.cache.clear()
+
+    def wall_textures(self, world_map, hits):
+        """Return the index into mapped of the texture each ray hit."""
+        # Rays that left a map without a border hit the nearest edge cell.
+        map_x = np.clip(hits.map_x, 0, world_map.height - 1)
+        map_y = np.clip(hits.map_y, 0, world_map.width - 1)
+        value = world_map[map_x, map_y].astype(np.intp)
+        texture = np.where(value > 0, (value - 1) % len(self.textures), 0)
+        return texture*2 + np.asarray(hits.side)
+
+    def scaled_column(self, texture, tex_x, lineHeight, h):
+        """
+        Return the on screen part of a texture column stretched to a line
+        height. Each row's texture coord is worked out with a multiply rather
+        than by adding step every row, so rounding errors don't build up.
+        """
+        drawStart = max(int(-lineHeight / 2 + h / 2), 0)
+        drawEnd = min(int(lineHeight / 2 + h / 2), h - 1)
+        # How much to increase the texture coord per screen pixel.
+        step = self.size / lineHeight
+        rows = np.arange(drawStart, drawEnd + 1)
+        tex_y = ((rows - h / 2 + lineHeight / 2) * step).astype(np.intp)
+        return self.mapped[texture][tex_x, tex_y & (self.size - 1)]
+
+    def draw(self, rasterizer, world_map, hits, pos, dir, plane, camera_x, h):
+        """Draw the textured wall stripe of every column of RayHits."""
+        self.map_textures(rasterizer.surface)
+        frame = rasterizer.frame
+
+        lineHeight = np.trunc(h / np.asarray(hits.perp_wall_dist))
+        lineHeight = lineHeight.astype(np.intp)
+        lineHeight -= lineHeight % self.height_step
+        texture = self.wall_textures(world_map, hits)
+        tex_x = texture_x(hits, pos, dir, plane, camera_x, self.size)
+
+        cache = self.cache
+        for x, key in enumerate(zip(texture.tolist(), tex_x.tolist(),
+                                    lineHeight.tolist())):
+            if key[2] <= 0:
+                continue
+            # The screen height is part of the key as it decides how much of
+            # a tall column is on screen.
+            key += (h,)
+            column = cache.get(key)
+            if column is None:
+                column = self.scaled_column(*key)
+                cache.put(key, column)
+            drawStart = max(int(-key[2] / 2 + h / 2), 0)
+            frame[x, drawStart:drawStart + len(column)] = column
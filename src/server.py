@@ -1,61 +1,234 @@
-import socket
-from _thread import start_new_thread
+import argparse
+import asyncio
+import time
+import protocol
+from spatialhash import SpatialHash
 
-clients = []
+# Largest message payload accepted from a client in bytes. Big enough for a
+# 4096x4096 map, a client sending more is disconnected.
+MAX_FRAME_SIZE = 32 * 1024 * 1024
+# Most frames that can wait to be sent to one client. A client that falls this
+# far behind is disconnected so it can't slow down or use up the memory of
+# the server for everybody else.
+MAX_QUEUED_FRAMES = 256
 
 
-def threaded(client):
+class Relay:
     """
-    Threaded function so more than one client can connect and interact with
-    the server at once. The server receives data from one client and then sends
-    that data to all the other clients.
+    Server that receives whole messages from each client and sends them on to
+    every other client. Pings are answered by the server.
     """
-    while True:
-        # Data received from the client.
-        data = client.recv(4096)
-        if not data:
-            print('Not Data.')
-            break
+    def __init__(self):
+        # Queue of frames waiting to be sent to each client, keyed by the
+        # client's stream writer.
+        self.clients = {}
 
-        # Send the data received from one client to all the other clients.
-        for c in clients:
-            if c != client:
-                c.sendall(data)
+    async def handle_client(self, reader, writer):
+        """
+        Read messages from one client for as long as it is connected and
+        forward each one to all the other clients.
+        """
+        addr = writer.get_extra_info("peername")
+        print(f"Connected to: {addr[0]}:{addr[1]}")
 
-    client.close()
+        frames = asyncio.Queue(MAX_QUEUED_FRAMES)
+        self.clients[writer] = frames
+        write_task = asyncio.create_task(self.write_loop(writer, frames))
 
+        try:
+            while True:
+                # Find how big the message to be received is in bytes.
+                length = await reader.readexactly(protocol.LENGTH.size)
+                length, = protocol.LENGTH.unpack(length)
+                if length > MAX_FRAME_SIZE:
+                    print(f"Message too big from {addr[0]}:{addr[1]}.")
+                    break
+                payload = await reader.readexactly(length)
+                self.handle_payload(writer, payload)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            print(f"Disconnected: {addr[0]}:{addr[1]}")
+            self.remove(writer)
+            write_task.cancel()
 
-def main():
+    def handle_payload(self, sender, payload):
+        """
+        Forward a message payload received from a client to the others, except
+        pings which are answered straight back to their sender. Pongs are
+        never forwarded so every client only gets replies to its own pings.
+        """
+        message_type = payload[:1]
+        if message_type == bytes([protocol.PING]):
+            if len(payload) == protocol.HEADER.size + protocol.PING_BODY.size:
+                _, client_id = protocol.HEADER.unpack_from(payload)
+                sent, = protocol.PING_BODY.unpack_from(payload,
+                                                       protocol.HEADER.size)
+                pong = protocol.encode_pong(protocol.SERVER_ID, client_id, sent)
+                self.queue_frame(sender, protocol.frame(pong))
+        elif message_type != bytes([protocol.PONG]):
+            self.broadcast(sender, protocol.frame(payload))
+
+    def broadcast(self, sender, data):
+        """Queue a frame to be sent to every client except its sender."""
+        for writer in list(self.clients):
+            if writer is not sender:
+                self.queue_frame(writer, data)
+
+    def queue_frame(self, writer, data):
+        """Queue a frame to be sent to one client."""
+        frames = self.clients.get(writer)
+        if frames is None:
+            return
+        try:
+            frames.put_nowait(data)
+        except asyncio.QueueFull:
+            print("Client too far behind, disconnecting.")
+            self.remove(writer)
+
+    async def write_loop(self, writer, frames):
+        """
+        Send queued frames to a client, waiting whenever its socket buffer is
+        full so a slow client only holds up its own queue.
+        """
+        try:
+            while True:
+                writer.write(await frames.get())
+                # Only wait for the buffer to empty once nothing else is
+                # queued, so queued frames are written together.
+                if frames.empty():
+                    await writer.drain()
+        except ConnectionError:
+            self.remove(writer)
+
+    def remove(self, writer):
+        """Forget about a client and close its connection."""
+        if self.clients.pop(writer, None) is not None:
+            writer.close()
+
+
+class SnapshotServer(Relay):
     """
-    Main server function where a socket is created and a loop waits for clients
-    to connect to the socket.
+    Server that keeps the latest position of every player and sends each
+    client one snapshot of the other players tick_rate times a second,
+    instead of forwarding every position message to every client. Map
+    messages are still forwarded straight away.
+
+    If an interest radius is given each snapshot only holds the players
+    within that many cells of the client, found with a spatial hash so the
+    work per client depends on how many players are nearby rather than how
+    many are connected. Player 1 is always included because every client
+    checks its map against theirs.
     """
-    # Host left to "" so when .bind() is called socket is binded to all interfaces.
-    host = ""
-    # Connection port
-    port = 5555
-    # Create an IPv4 (AF_INET), TCP (SOCK_STREAM) socket.
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    # bind() associates the socket with its local address
-    # server side binds so that clients can use that address to connect to server
-    s.bind((host, port))
+    def __init__(self, tick_rate=20, interest_radius=None):
+        super().__init__()
+        self.tick_rate = tick_rate
+        self.interest_radius = interest_radius
+        # Snapshot entry of the latest position of each player, keyed by the
+        # player's stream writer.
+        self.players = {}
+        # Client id of each player.
+        self.ids = {}
+        # Positions of the players, in buckets as wide as the interest radius
+        # so only the 3x3 buckets around a client need to be searched.
+        self.grid = SpatialHash(interest_radius or 1)
+
+    def handle_payload(self, sender, payload):
+        """Store position messages and forward any other messages."""
+        if payload[:1] == bytes([protocol.POSITION]):
+            # Positions that are the wrong size are dropped rather than
+            # being sent on in every snapshot.
+            if len(payload) != 1 + protocol.SNAPSHOT_ENTRY_SIZE:
+                return
+            self.players[sender] = protocol.snapshot_entry(payload)
+            _, self.ids[sender] = protocol.HEADER.unpack_from(payload)
+            if self.interest_radius:
+                x, y, _, _ = protocol.POSITION_BODY.unpack_from(
+                    payload, protocol.HEADER.size)
+                self.grid.move(sender, x / protocol.POSITION_SCALE,
+                               y / protocol.POSITION_SCALE)
+        else:
+            super().handle_payload(sender, payload)
+
+    def remove(self, writer):
+        self.players.pop(writer, None)
+        self.ids.pop(writer, None)
+        self.grid.discard(writer)
+        super().remove(writer)
+
+    def interesting_players(self, writer, player_1):
+        """Return the players whose positions should be sent to a client."""
+        pos = self.grid.position(writer)
+        # Clients that haven't sent a position yet are sent everybody.
+        if not self.interest_radius or pos is None:
+            return self.players
+        players = set(self.grid.near(*pos, self.interest_radius))
+        if player_1 is not None:
+            players.add(player_1)
+        return players
+
+    def send_snapshots(self):
+        """Queue a snapshot of the other players for every client."""
+        player_1 = min(self.ids, key=self.ids.get, default=None)
+        for writer in list(self.clients):
+            entries = [self.players[player]
+                       for player in self.interesting_players(writer, player_1)
+                       if player is not writer]
+            self.queue_frame(writer,
+                             protocol.frame(protocol.encode_snapshot(entries)))
+
+    async def tick_loop(self):
+        """Send snapshots at a fixed rate for as long as the server runs."""
+        interval = 1 / self.tick_rate
+        next_tick = time.monotonic()
+        while True:
+            self.send_snapshots()
+            next_tick += interval
+            await asyncio.sleep(max(next_tick - time.monotonic(), 0))
+
+
+async def serve(host, port, tick_rate=None, interest_radius=None):
+    """
+    Accept clients until cancelled, either relaying their messages or, if a
+    tick rate is given, sending them snapshots at that rate of the players
+    within interest_radius cells (or all of them if None).
+    """
+    if tick_rate:
+        relay = SnapshotServer(tick_rate, interest_radius)
+        # A reference to the task is kept so it isn't garbage collected.
+        tick_task = asyncio.create_task(relay.tick_loop())
+    else:
+        relay = Relay()
+    server = await asyncio.start_server(relay.handle_client, host, port,
+                                        backlog=1024)
     print("Socket binded to port:", port)
-    # Put the socket into listening mode.
-    s.listen(2)
     print("Socket is listening.")
+    async with server:
+        await server.serve_forever()
 
-    # A forever loop until the client wants to exit.
-    while True:
-        # Establish a connection with the client.
-        c, addr = s.accept()
-        clients.append(c)
-
-        print(f"Connected to: {addr[0]}:{addr[1]}")
 
-        # Start a new thread and return its identifier.
-        start_new_thread(threaded, (c,))
+def main():
+    """
+    Main server function where a socket is created and an event loop relays
+    messages between every connected client.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tick-rate", type=float,
+                        help="send snapshots this many times a second instead "
+                             "of relaying every position message, e.g. 20")
+    parser.add_argument("--interest-radius", type=float,
+                        help="with --tick-rate, only send each client the "
+                             "players within this many cells of it")
+    args = parser.parse_args()
 
-    s.close()
+    # Host left to "" so the server is bound to all interfaces.
+    host = ""
+    # Connection port
+    port = 5555
+    try:
+        asyncio.run(serve(host, port, args.tick_rate, args.interest_radius))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == '__main__':
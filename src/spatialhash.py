@@ -0,0 +1,68 @@
+"""
+Uniform grid spatial hash for finding the items near a point without looking
+at every item.
+"""
+
+
+class SpatialHash:
+    """
+    Items with a position, grouped into square buckets of map cells. Finding
+    the items near a point only looks in the buckets around it, so the cost
+    depends on how crowded that part of the map is and not on the total
+    number of items.
+    """
+    def __init__(self, bucket_size):
+        # Width of each bucket in map cells.
+        self.bucket_size = bucket_size
+        # Set of items in each bucket, keyed by the bucket's (row, col).
+        self.buckets = {}
+        # Bucket and position of each item.
+        self.items = {}
+
+    def bucket(self, x, y):
+        """Return the key of the bucket the point (x, y) is in."""
+        return int(x // self.bucket_size), int(y // self.bucket_size)
+
+    def move(self, item, x, y):
+        """Add an item at (x, y), or move it there if it's already added."""
+        key = self.bucket(x, y)
+        old = self.items.get(item)
+        if old is not None and old[0] != key:
+            self.discard(item)
+        self.buckets.setdefault(key, set()).add(item)
+        self.items[item] = (key, x, y)
+
+    def discard(self, item):
+        """Remove an item if it has been added."""
+        old = self.items.pop(item, None)
+        if old is None:
+            return
+        bucket = self.buckets[old[0]]
+        bucket.discard(item)
+        # Empty buckets are dropped so only occupied parts of the map use
+        # memory.
+        if not bucket:
+            del self.buckets[old[0]]
+
+    def position(self, item):
+        """Return the (x, y) position of an item, or None if not added."""
+        entry = self.items.get(item)
+        return None if entry is None else entry[1:]
+
+    def near(self, x, y, radius):
+        """Yield every item within radius of the point (x, y)."""
+        (min_row, min_col) = self.bucket(x - radius, y - radius)
+        (max_row, max_col) = self.bucket(x + radius, y + radius)
+        radius_squared = radius * radius
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for item in self.buckets.get((row, col), ()):
+                    _, item_x, item_y = self.items[item]
+                    if (item_x - x)**2 + (item_y - y)**2 <= radius_squared:
+                        yield item
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
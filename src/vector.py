@@ -1,7 +1,11 @@
 import math
+import numpy as np
 
 
 class Vector:
+    # __slots__ so vectors are small and quick to create and access.
+    __slots__ = ("x", "y")
+
     def __init__(self, x=0, y=0):
         self.x = x
         self.y = y
@@ -19,10 +23,11 @@ class Vector:
         If two vectors are multiplied together return their dot product.
         Otherwise return a vector multiplied by a scalar value.
         """
-        if type(self) == type(other):
-            return self.dot(other)
-        elif isinstance(other, (int, float)):
+        if isinstance(other, Vector):
+            return self.x*other.x + self.y*other.y
+        if isinstance(other, (int, float)):
             return Vector(self.x*other, self.y*other)
+        return NotImplemented
 
     def __rmul__(self, other):
         """
@@ -31,10 +36,42 @@ class Vector:
         """
         return self.__mul__(other)
 
-    def __div__(self, other):
+    def __truediv__(self, other):
         """Return a vector divided by a scalar value."""
         if isinstance(other, (int, float)):
             return Vector(self.x/other, self.y/other)
+        return NotImplemented
+
+    def __iadd__(self, other):
+        """Add another vector to this vector in place."""
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def __isub__(self, other):
+        """Subtract another vector from this vector in place."""
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def __imul__(self, other):
+        """Multiply this vector by a scalar value in place."""
+        if isinstance(other, (int, float)):
+            self.x *= other
+            self.y *= other
+            return self
+        return NotImplemented
+
+    def __itruediv__(self, other):
+        """Divide this vector by a scalar value in place."""
+        if isinstance(other, (int, float)):
+            self.x /= other
+            self.y /= other
+            return self
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Vector({self.x}, {self.y})"
 
     def dot(self, other):
         """Return the dot product of two vectors."""
@@ -52,6 +89,18 @@ class Vector:
         self.x = normalized_x
         self.y = normalized_y
 
+    def rotate(self, angle):
+        """
+        Rotate a vector in place by an angle in radians by multiplying its x
+        and y components by the rotation matrix:
+        [ cos(Θ) -sin(Θ) ]
+        [ sin(Θ)  cos(Θ) ]
+        Where Θ is the angle to rotate by. Positive angles rotate to the left.
+        """
+        cos = math.cos(angle)
+        sin = math.sin(angle)
+        self.x, self.y = self.x*cos - self.y*sin, self.x*sin + self.y*cos
+
     def coords(self):
         """Return the x and y components of the vector as a tuple pair."""
         return self.x, self.y
@@ -67,3 +116,89 @@ class Vector:
     def from_angle(cls, angle):
         """Create a vector given an angle."""
         return cls(math.cos(angle), math.sin(angle))
+
+
+class VectorArray:
+    """
+    N vectors stored as two contiguous arrays of x and y components, so
+    operations on all of them are done at once by NumPy.
+    """
+    __slots__ = ("x", "y")
+
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+
+    @classmethod
+    def zeros(cls, n):
+        """Create an array of n zero vectors."""
+        return cls(np.zeros(n), np.zeros(n))
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        """Create an array from a sequence of Vectors."""
+        return cls([v.x for v in vectors], [v.y for v in vectors])
+
+    @classmethod
+    def along(cls, origin, direction, t):
+        """
+        Return the vectors origin + direction*t for every value in the array
+        t, where origin and direction are Vectors.
+        """
+        t = np.asarray(t, dtype=float)
+        return cls(origin.x + direction.x*t, origin.y + direction.y*t)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, index):
+        """Return one Vector, or a VectorArray for a slice or index array."""
+        if isinstance(index, (int, np.integer)):
+            return Vector(float(self.x[index]), float(self.y[index]))
+        return VectorArray(self.x[index], self.y[index])
+
+    def __add__(self, other):
+        """Add a Vector or VectorArray to every vector."""
+        return VectorArray(self.x + other.x, self.y + other.y)
+
+    def __sub__(self, other):
+        """Subtract a Vector or VectorArray from every vector."""
+        return VectorArray(self.x - other.x, self.y - other.y)
+
+    def __mul__(self, other):
+        """Multiply every vector by a scalar or an array of scalars."""
+        return VectorArray(self.x*other, self.y*other)
+
+    __rmul__ = __mul__
+
+    def __iadd__(self, other):
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def __isub__(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def __imul__(self, other):
+        self.x *= other
+        self.y *= other
+        return self
+
+    def dot(self, other):
+        """Return the dot product of every vector with a Vector/ VectorArray."""
+        return self.x*other.x + self.y*other.y
+
+    def mag(self):
+        """Return the magnitude of every vector."""
+        return np.hypot(self.x, self.y)
+
+    def rotate(self, angle):
+        """
+        Rotate every vector in place by an angle, or by an array of angles
+        one per vector, in radians.
+        """
+        cos = np.cos(angle)
+        sin = np.sin(angle)
+        self.x, self.y = self.x*cos - self.y*sin, self.x*sin + self.y*cos